@@ -1,13 +1,16 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR
 from django.http import HttpResponseRedirect
 from django.shortcuts import reverse
 from django.templatetags.static import static
 from django.utils.html import format_html
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.db import models
-from django.db.models import Count, Q
+from django.db.models import Case, Count, Q, When
 
 from .models import (
+    Banner,
     Order,
     OrderItem,
     Restaurant,
@@ -15,6 +18,10 @@ from .models import (
     RestaurantMenuItem,
     ProductCategory,
 )
+from .renditions import get_rendition_url
+from .spatial import get_restaurant_index
+from places.addresses import normalize_address
+from places.services import get_known_places
 from star_burger.settings import ALLOWED_HOSTS
 
 
@@ -40,6 +47,24 @@ class RestaurantAdmin(admin.ModelAdmin):
     ]
 
 
+class ProductAvailabilityFilter(admin.SimpleListFilter):
+    title = 'в продаже'
+    parameter_name = 'available'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('yes', 'Да'),
+            ('no', 'Нет'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.available()
+        if self.value() == 'no':
+            return queryset.filter(available_restaurants_count=0)
+        return queryset
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = [
@@ -53,10 +78,10 @@ class ProductAdmin(admin.ModelAdmin):
     ]
     list_filter = [
         'category',
+        ProductAvailabilityFilter,
     ]
+    # Поиск идёт по полнотекстовому и триграммному индексам, см. get_search_results
     search_fields = [
-        # FIXME SQLite can not convert letter case for cyrillic words properly, so search will be buggy.
-        # Migration to PostgreSQL is necessary
         'name',
         'category__name',
     ]
@@ -99,17 +124,30 @@ class ProductAdmin(admin.ModelAdmin):
     def get_image_preview(self, obj):
         if not obj.image:
             return 'выберите картинку'
-        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url)
+        url = get_rendition_url(obj.image, obj.image_renditions, 'medium')
+        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=url)
 
     get_image_preview.short_description = 'превью'
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # Список сортируется до поиска, поэтому по умолчанию наверху
+        # остаются самые релевантные товары, а выбранная пользователем
+        # сортировка по колонке возвращается поверх ранга
+        results = queryset.search(search_term)
+        if ORDER_VAR in request.GET:
+            results = results.order_by(*queryset.query.order_by)
+        return results, False
+
     def get_image_list_preview(self, obj):
         if not obj.image or not obj.id:
             return 'нет картинки'
         edit_url = reverse('admin:foodcartapp_product_change', args=(obj.id,))
         return format_html(
             '<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>',
-            edit_url=edit_url, src=obj.image.url)
+            edit_url=edit_url, src=obj.image_thumbnail_url)
 
     get_image_list_preview.short_description = 'превью'
 
@@ -119,6 +157,36 @@ class ProductAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(Banner)
+class BannerAdmin(admin.ModelAdmin):
+    list_display = [
+        'get_image_list_preview',
+        'title',
+        'order',
+        'is_active',
+        'starts_at',
+        'ends_at',
+    ]
+    list_display_links = [
+        'title',
+    ]
+    list_editable = [
+        'order',
+        'is_active',
+    ]
+    list_filter = [
+        'is_active',
+    ]
+
+    def get_image_list_preview(self, obj):
+        if not obj.image:
+            return 'нет картинки'
+        src = get_rendition_url(obj.image, obj.image_renditions, 'medium')
+        return format_html('<img src="{src}" style="max-height: 50px;"/>', src=src)
+
+    get_image_list_preview.short_description = 'превью'
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     feilds = [
@@ -128,6 +196,41 @@ class OrderItemInline(admin.TabularInline):
     short_description = 'Заказанные товары'
 
 
+def order_by_distance(restaurants, address, keep_restaurant_id=None):
+    # Ближайшие к адресу заказа рестораны показываются в списке первыми,
+    # рестораны за пределами радиуса доставки скрываются (кроме уже
+    # назначенного), а рестораны без координат остаются в конце списка.
+    # Координаты берутся только из индекса и таблицы мест, геокодер
+    # из формы не вызывается: новые адреса ресторанов индекс отправляет
+    # на геокодирование в фоне
+    place = get_known_places([address]).get(normalize_address(address))
+    if not place:
+        return restaurants
+    restaurant_index = get_restaurant_index()
+    restaurant_ids = set(restaurants.values_list('id', flat=True))
+    nearest_restaurants = restaurant_index.nearest(
+        place.latitude,
+        place.longitude,
+        radius_km=settings.DELIVERY_RADIUS_KM,
+        restaurant_ids=restaurant_ids,
+    )
+    nearest_ids = [restaurant_id for restaurant_id, _ in nearest_restaurants]
+    too_far_ids = [
+        restaurant_id for restaurant_id in restaurant_ids
+        if restaurant_id in restaurant_index
+        and restaurant_id not in nearest_ids
+        and restaurant_id != keep_restaurant_id
+    ]
+    return restaurants.exclude(pk__in=too_far_ids).order_by(
+        Case(
+            *[When(pk=restaurant_id, then=position) for position, restaurant_id in enumerate(nearest_ids)],
+            default=len(nearest_ids),
+            output_field=models.IntegerField(),
+        ),
+        'name',
+    )
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     inlines = [
@@ -137,10 +240,16 @@ class OrderAdmin(admin.ModelAdmin):
         'firstname',
         'lastname',
         'address',
+        'total_price',
+    ]
+    readonly_fields = [
+        'total_price',
     ]
 
     def save_formset(self, request, form, formset, change):
         order_items = formset.save(commit=False)
+        for item in formset.deleted_objects:
+            item.delete()
         for item in order_items:
             if item.price == 0.00:
                 product = Product.objects.get(id=item.product.id)
@@ -148,6 +257,7 @@ class OrderAdmin(admin.ModelAdmin):
                 item.save()
             else:
                 item.save()
+        Order.objects.filter(pk=form.instance.pk).refresh_total_price()
 
     def response_post_save_change(self, request, obj):
         res = super().response_post_save_change(request, obj)
@@ -179,8 +289,17 @@ class OrderAdmin(admin.ModelAdmin):
                         filter=Q(menu_items__product_id__in=product_ids) & Q(menu_items__availability=True)
                     )
                 ).filter(num_matching_products=len(product_ids)).distinct()
+                # Назначенный ресторан остаётся в списке, даже если товары
+                # в нём закончились, иначе форма заказа не сохранится
+                available_restaurants = Restaurant.objects.filter(
+                    Q(pk__in=available_restaurants.values('pk')) | Q(pk=order.restaurant_id)
+                )
 
-                kwargs["queryset"] = available_restaurants
+                kwargs["queryset"] = order_by_distance(
+                    available_restaurants,
+                    order.address,
+                    keep_restaurant_id=order.restaurant_id,
+                )
             else:
                 # Если товаров нет, показываем все рестораны
                 kwargs["queryset"] = Restaurant.objects.all()
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Banner
+from .renditions import build_srcset
+
+BANNERS_KEY = 'banners:content'
+
+
+def serialize_banner(banner):
+    return {
+        'title': banner.title,
+        'src': banner.image.url,
+        'text': banner.text,
+        'srcset': build_srcset(banner.image, banner.image_renditions),
+    }
+
+
+def get_next_window_change(now):
+    # Ближайший момент, когда какой-то баннер появится или исчезнет
+    boundaries = Banner.objects.filter(is_active=True).aggregate(
+        next_start=Min('starts_at', filter=Q(starts_at__gt=now)),
+        next_end=Min('ends_at', filter=Q(ends_at__gt=now)),
+    )
+    moments = [moment for moment in boundaries.values() if moment]
+    return min(moments) if moments else None
+
+
+def build_banners(now):
+    banners = Banner.objects.active(now)
+    return DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':')).encode(
+        [serialize_banner(banner) for banner in banners]
+    ).encode()
+
+
+def get_banners_content():
+    content = cache.get(BANNERS_KEY)
+    if content is not None:
+        return content
+
+    now = timezone.now()
+    content = build_banners(now)
+    next_change = get_next_window_change(now)
+    # Кэш живёт до ближайшего открытия или закрытия окна показа, но не
+    # дольше BANNERS_CACHE_TIMEOUT: чтение, совпавшее со сбросом после
+    # коммита, может положить в кэш устаревший список
+    timeout = settings.BANNERS_CACHE_TIMEOUT
+    if next_change:
+        timeout = min(timeout, (next_change - now).total_seconds())
+    cache.set(BANNERS_KEY, content, timeout=timeout)
+    return content
+
+
+def invalidate_banners():
+    transaction.on_commit(lambda: cache.delete(BANNERS_KEY))
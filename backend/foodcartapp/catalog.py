@@ -0,0 +1,250 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, QuerySet
+
+from .models import (
+    CatalogChange,
+    CatalogVersion,
+    Product,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from .renditions import build_srcset, serialize_renditions
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_SNAPSHOT_KEY = 'catalog:snapshot'
+RESTAURANT_MENU_KEY = 'restaurant_menu:{restaurant_id}'
+
+
+# Поле ответа -> колонки, которые нужно прочитать из БД, и функция сериализации
+PRODUCT_FIELDS = {
+    'id': (['id'], lambda product: product.id),
+    'name': (['name'], lambda product: product.name),
+    'price': (['price'], lambda product: product.price),
+    'special_status': (['special_status'], lambda product: product.special_status),
+    'description': (['description'], lambda product: product.description),
+    'category': (['category__id', 'category__name'], lambda product: {
+        'id': product.category.id,
+        'name': product.category.name,
+    } if product.category else None),
+    'image': (['image'], lambda product: product.image.url),
+    'image_renditions': (['image', 'image_renditions'], lambda product: serialize_renditions(
+        product.image, product.image_renditions,
+    )),
+    'image_srcset': (['image', 'image_renditions'], lambda product: build_srcset(
+        product.image, product.image_renditions,
+    )),
+    'restaurant': (['name'], lambda product: {
+        'id': product.id,
+        'name': product.name,
+    }),
+}
+
+
+def parse_fields(value):
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown_fields = [field for field in fields if field not in PRODUCT_FIELDS]
+    if unknown_fields:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown_fields)}")
+    return fields
+
+
+def parse_page(params):
+    cursor = params.get('cursor')
+    limit = params.get('limit')
+    if cursor is None and limit is None:
+        return None, None
+
+    try:
+        cursor = int(cursor) if cursor is not None else 0
+        limit = int(limit) if limit is not None else settings.CATALOG_PAGE_SIZE
+    except ValueError:
+        raise ValueError('cursor и limit должны быть целыми числами')
+    if cursor < 0 or limit < 1:
+        raise ValueError('cursor и limit должны быть положительными')
+    return cursor, min(limit, settings.CATALOG_MAX_PAGE_SIZE)
+
+
+def serialize_product(product, fields=None):
+    return {
+        field: PRODUCT_FIELDS[field][1](product)
+        for field in fields or PRODUCT_FIELDS
+    }
+
+
+def get_catalog_products(fields=None):
+    products = Product.objects.available().order_by('id')
+    if fields is None or 'category' in fields:
+        products = products.select_related('category')
+    if fields is not None:
+        columns = {column for field in fields for column in PRODUCT_FIELDS[field][0]}
+        products = products.only(*columns)
+    return products
+
+
+def get_catalog_page(fields, cursor, limit):
+    # Keyset-пагинация по id: следующая страница начинается после последнего id
+    products = list(get_catalog_products(fields).filter(id__gt=cursor)[:limit])
+    next_cursor = products[-1].id if len(products) == limit else None
+    return products, next_cursor
+
+
+def iter_catalog_json(products, fields=None, chunk_size=None):
+    # Товары читаются курсором на стороне сервера и отдаются
+    # компактными кусками, поэтому память не растёт вместе с каталогом
+    chunk_size = chunk_size or settings.CATALOG_CHUNK_SIZE
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    if isinstance(products, QuerySet):
+        products = products.iterator(chunk_size=chunk_size)
+
+    yield b'['
+    chunk = []
+    separator = ''
+    for product in products:
+        chunk.append(separator + encoder.encode(serialize_product(product, fields)))
+        separator = ','
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode()
+    yield b']'
+
+
+def build_catalog():
+    content = b''.join(iter_catalog_json(get_catalog_products()))
+    etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+    return etag, content
+
+
+def read_catalog_version():
+    return CatalogVersion.objects.values_list('value', flat=True).get(pk=1)
+
+
+def publish_catalog_version():
+    caches[settings.VERSION_CACHE].set(CATALOG_VERSION_KEY, read_catalog_version(), timeout=None)
+
+
+def record_catalog_changes(product_ids):
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+
+    with transaction.atomic():
+        # Блокировка строки счётчика выстраивает версии в порядке коммитов,
+        # поэтому клиент с ?since=N не пропустит позже закоммиченное изменение
+        catalog_version = CatalogVersion.objects.select_for_update().get(pk=1)
+        catalog_version.value += 1
+        catalog_version.save(update_fields=['value'])
+
+        CatalogChange.objects.bulk_create([
+            CatalogChange(version=catalog_version.value, product_id=product_id)
+            for product_id in product_ids
+        ])
+        # Новая версия публикуется только после коммита транзакции,
+        # иначе снимок может собраться из ещё не зафиксированных данных
+        transaction.on_commit(publish_catalog_version)
+
+
+def get_catalog_version():
+    versions_cache = caches[settings.VERSION_CACHE]
+    version = versions_cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = read_catalog_version()
+        versions_cache.add(CATALOG_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def get_catalog_snapshot():
+    # Версия и снимок читаются из кэша за одно обращение
+    versions_cache = caches[settings.VERSION_CACHE]
+    cached = versions_cache.get_many([CATALOG_VERSION_KEY, CATALOG_SNAPSHOT_KEY])
+    version = cached.get(CATALOG_VERSION_KEY)
+    snapshot = cached.get(CATALOG_SNAPSHOT_KEY)
+
+    if version is None:
+        version = get_catalog_version()
+
+    if snapshot and snapshot['version'] == version:
+        return version, snapshot['etag'], snapshot['content']
+
+    etag, content = build_catalog()
+    versions_cache.set(CATALOG_SNAPSHOT_KEY, {
+        'version': version,
+        'etag': etag,
+        'content': content,
+    }, timeout=None)
+    return version, etag, content
+
+
+class CatalogResyncRequired(Exception):
+    pass
+
+
+def get_catalog_delta(since):
+    version, pruned_through = CatalogVersion.objects.values_list('value', 'pruned_through').get(pk=1)
+    if since < pruned_through:
+        # Журнал за этот период уже очищен, клиенту нужен полный каталог
+        raise CatalogResyncRequired(version)
+    changed_ids = set(
+        CatalogChange.objects
+        .filter(version__gt=since, version__lte=version)
+        .values_list('product_id', flat=True)
+    )
+    changed_products = list(get_catalog_products().filter(id__in=changed_ids))
+    removed_ids = changed_ids - {product.id for product in changed_products}
+    return version, changed_products, sorted(removed_ids)
+
+
+def prune_catalog_changes(older_than):
+    with transaction.atomic():
+        catalog_version = CatalogVersion.objects.select_for_update().get(pk=1)
+        cutoff = (
+            CatalogChange.objects
+            .filter(changed_at__lt=older_than)
+            .aggregate(cutoff=Max('version'))['cutoff']
+        )
+        if cutoff is None:
+            return 0
+        # Удаление идёт по версии, а не по времени: в журнале не остаётся
+        # дыр, и клиент с ?since не ниже pruned_through получает полную дельту
+        deleted, _ = CatalogChange.objects.filter(version__lte=cutoff).delete()
+        catalog_version.pruned_through = max(catalog_version.pruned_through, cutoff)
+        catalog_version.save(update_fields=['pruned_through'])
+        return deleted
+
+
+def get_restaurant_menu_product_ids(restaurant_id):
+    key = RESTAURANT_MENU_KEY.format(restaurant_id=restaurant_id)
+    product_ids = cache.get(key)
+    if product_ids is not None:
+        return product_ids
+
+    if not Restaurant.objects.filter(pk=restaurant_id).exists():
+        return None
+    product_ids = list(
+        RestaurantMenuItem.objects
+        .filter(restaurant_id=restaurant_id, availability=True)
+        .order_by('product_id')
+        .values_list('product_id', flat=True)
+    )
+    # Таймаут ограничивает устаревание, если запись попала в кэш
+    # одновременно со сбросом после коммита
+    cache.set(key, product_ids, timeout=settings.RESTAURANT_MENU_CACHE_TIMEOUT)
+    return product_ids
+
+
+def invalidate_restaurant_menus(restaurant_ids):
+    # Сбрасываем только меню затронутых ресторанов, остальные остаются в кэше
+    keys = [
+        RESTAURANT_MENU_KEY.format(restaurant_id=restaurant_id)
+        for restaurant_id in set(restaurant_ids)
+    ]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,72 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def get_request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.request_fingerprint != fingerprint:
+        return Response(
+            {'detail': 'Ключ идемпотентности уже использован с другим запросом'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(
+        record.response_body,
+        status=record.response_status,
+        headers={'Idempotent-Replayed': 'true'},
+    )
+
+
+def idempotent(view):
+    # Повтор запроса с тем же Idempotency-Key получает сохранённый ответ
+    # и не доходит до таблиц заказов
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response(
+                {'detail': f'Слишком длинный {IDEMPOTENCY_HEADER}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = get_request_fingerprint(request)
+        now = timezone.now()
+        with transaction.atomic():
+            IdempotencyKey.objects.filter(key=key, expires_at__lte=now).delete()
+            try:
+                # Ключ занимается до выполнения запроса: параллельный повтор
+                # дождётся коммита на уникальном индексе и получит готовый ответ
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        key=key,
+                        request_fingerprint=fingerprint,
+                        expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                    )
+            except IntegrityError:
+                return replay(IdempotencyKey.objects.get(key=key), fingerprint)
+
+            response = view(request, *args, **kwargs)
+            record.response_status = response.status_code
+            record.response_body = response.data
+            record.save(update_fields=['response_status', 'response_body'])
+        return response
+
+    return wrapper
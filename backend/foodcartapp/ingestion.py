@@ -0,0 +1,99 @@
+import json
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+from .models import OrderIngestion
+from .serializers import OrderSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_order(serializer):
+    # Проверенные данные заказа сохраняются одной вставкой,
+    # а сам заказ создаст фоновый обработчик
+    return OrderIngestion.objects.create(payload=serializer.initial_data)
+
+
+def save_orders(serializer, valid_indexes):
+    # Сначала весь пакет одной вставкой в точке сохранения. Если база отвергла
+    # какой-то заказ, пакет откатывается и заказы вставляются по одному,
+    # чтобы один испорченный заказ не блокировал очередь
+    try:
+        with transaction.atomic():
+            return dict(zip(valid_indexes, serializer.save())), {}
+    except DatabaseError as error:
+        logger.warning(f"Пакет заказов не вставился целиком, вставляем по одному: {error}")
+
+    orders = {}
+    errors = {}
+    for index, order_data in zip(valid_indexes, serializer.validated_data):
+        try:
+            with transaction.atomic():
+                orders[index] = serializer.child.create(dict(order_data))
+        except DatabaseError as error:
+            errors[index] = {api_settings.NON_FIELD_ERRORS_KEY: [str(error).strip()]}
+    return orders, errors
+
+
+def create_orders(serializer):
+    errors = dict(serializer.item_errors)
+    valid_indexes = [index for index in range(len(serializer.initial_data)) if index not in errors]
+    orders, database_errors = save_orders(serializer, valid_indexes)
+    errors.update(database_errors)
+    return orders, errors
+
+
+def process_ingestion_batch(batch_size):
+    # Больший пакет сериализатор отверг бы целиком
+    batch_size = min(batch_size, settings.ORDER_BATCH_MAX_SIZE)
+    with transaction.atomic():
+        ingestions = list(
+            OrderIngestion.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OrderIngestion.PENDING)
+            .order_by('id')[:batch_size]
+        )
+        if not ingestions:
+            return 0
+
+        # Весь пакет проверяется целиком, ошибки разбираются по заказам
+        payloads = [ingestion.payload for ingestion in ingestions]
+        serializer = OrderSerializer(data=payloads, many=True)
+        if serializer.is_valid():
+            orders, errors = create_orders(serializer)
+        else:
+            # Пакет отвергнут целиком. Заказы проверяются по одному,
+            # чтобы ошибка пакета не провалила все заказы разом
+            logger.warning(f"Пакет заказов не прошёл проверку, проверяем по одному: {serializer.errors}")
+            orders = {}
+            errors = {}
+            for index, payload in enumerate(payloads):
+                single = OrderSerializer(data=[payload], many=True)
+                if not single.is_valid():
+                    errors[index] = single.errors
+                    continue
+                single_orders, single_errors = create_orders(single)
+                if single_errors:
+                    errors[index] = single_errors[0]
+                else:
+                    orders[index] = single_orders[0]
+
+        processed_at = timezone.now()
+        for index, ingestion in enumerate(ingestions):
+            if index in errors:
+                ingestion.status = OrderIngestion.FAILED
+                ingestion.error = json.dumps(errors[index], ensure_ascii=False)
+                logger.error(f"Не удалось создать заказ {ingestion.reference}: {ingestion.error}")
+            else:
+                ingestion.status = OrderIngestion.DONE
+                ingestion.order = orders[index]
+            ingestion.processed_at = processed_at
+
+        OrderIngestion.objects.bulk_update(
+            ingestions, ['order', 'status', 'error', 'processed_at']
+        )
+    return len(ingestions)
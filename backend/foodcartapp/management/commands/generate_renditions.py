@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.banners import invalidate_banners
+from foodcartapp.catalog import record_catalog_changes
+from foodcartapp.models import Banner, Product
+from foodcartapp.renditions import BANNER_RENDITIONS, PRODUCT_RENDITIONS, refresh_renditions
+
+
+class Command(BaseCommand):
+    help = 'Готовит уменьшенные копии картинок товаров и баннеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать копии, даже если они уже есть',
+        )
+
+    def handle(self, *args, **options):
+        updated_products = self.refresh(Product, PRODUCT_RENDITIONS, options['force'])
+        record_catalog_changes(updated_products)
+        updated_banners = self.refresh(Banner, BANNER_RENDITIONS, options['force'])
+        if updated_banners:
+            invalidate_banners()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено товаров: {len(updated_products)}, баннеров: {len(updated_banners)}'
+        ))
+
+    def refresh(self, model, sizes, force):
+        updated = []
+        for instance in model.objects.exclude(image='').only('id', 'image', 'image_renditions').iterator():
+            renditions = refresh_renditions(instance, sizes, force=force)
+            if renditions is None:
+                continue
+            model.objects.filter(pk=instance.pk).update(image_renditions=renditions)
+            updated.append(instance.pk)
+        return updated
@@ -0,0 +1,94 @@
+from argparse import ArgumentTypeError
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from foodcartapp.models import Order, Restaurant
+from places.addresses import normalize_address
+from places.geocoder import RequestThrottle
+from places.models import Place
+from places.services import geocode_addresses
+
+
+def positive(number_type):
+    def parse(value):
+        try:
+            number = number_type(value)
+        except ValueError:
+            raise ArgumentTypeError(f'ожидается число, получено {value!r}')
+        if not number > 0:
+            raise ArgumentTypeError(f'должно быть больше нуля, получено {value}')
+        return number
+    return parse
+
+
+class Command(BaseCommand):
+    help = 'Заранее геокодирует адреса ресторанов и открытых заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=positive(int),
+            default=50,
+            help='Сколько адресов геокодировать за один пакет',
+        )
+        parser.add_argument(
+            '--rate',
+            type=positive(float),
+            default=10.0,
+            help='Не больше стольких запросов к геокодеру в секунду',
+        )
+
+    def collect_addresses(self):
+        addresses_by_key = {}
+        restaurant_addresses = Restaurant.objects.values_list('address', flat=True)
+        order_addresses = (
+            Order.objects
+            .exclude(status__in=[Order.ORDER_CLOSED, Order.ORDER_CANCELED])
+            .values_list('address', flat=True)
+            .distinct()
+        )
+        for address in [*restaurant_addresses, *order_addresses]:
+            addresses_by_key.setdefault(normalize_address(address), address)
+        return addresses_by_key
+
+    def handle(self, *args, **options):
+        addresses_by_key = self.collect_addresses()
+        places = Place.objects.in_bulk(addresses_by_key, field_name='address_key')
+        now = timezone.now()
+
+        stale_addresses = []
+        postponed = 0
+        for key, address in sorted(addresses_by_key.items()):
+            place = places.get(key)
+            if place is None or place.needs_geocoding(now):
+                stale_addresses.append(address)
+            elif not place.has_coordinates:
+                postponed += 1
+
+        self.stdout.write(
+            f'Адресов: {len(addresses_by_key)}, геокодировать: {len(stale_addresses)}, '
+            f'отложено после ошибок: {postponed}'
+        )
+
+        batch_size = options['batch_size']
+        # Темп задаётся для каждого запроса: потоки geocode_addresses
+        # делят один RequestThrottle и не отправляют запросы пачкой
+        throttle = RequestThrottle(options['rate'])
+        resolved = 0
+        failed = []
+        for start in range(0, len(stale_addresses), batch_size):
+            batch = stale_addresses[start:start + batch_size]
+            place_map = geocode_addresses(batch, throttle=throttle)
+
+            batch_failed = [address for address in batch if normalize_address(address) not in place_map]
+            failed.extend(batch_failed)
+            resolved += len(batch) - len(batch_failed)
+            self.stdout.write(
+                f'Обработано {start + len(batch)} из {len(stale_addresses)}, '
+                f'найдено {resolved}, ошибок {len(failed)}'
+            )
+
+        for address in failed:
+            self.stderr.write(f'Не удалось геокодировать: {address}')
+        self.stdout.write(self.style.SUCCESS(f'Готово: найдено {resolved}, ошибок {len(failed)}'))
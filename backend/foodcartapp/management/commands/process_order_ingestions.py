@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.ingestion import process_ingestion_batch
+
+
+class Command(BaseCommand):
+    help = 'Создаёт заказы из очереди входящих заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Сколько заказов обрабатывать в одной транзакции, не больше ORDER_BATCH_MAX_SIZE',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, опрашивая очередь',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Пауза между опросами пустой очереди, в секундах',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_ingestion_batch(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Обработано заказов: {processed}')
+                continue
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from foodcartapp.catalog import prune_catalog_changes
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из журнала изменений каталога записи старше срока хранения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.CATALOG_CHANGES_RETENTION_DAYS,
+            help='Сколько дней хранить журнал изменений',
+        )
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - timedelta(days=options['days'])
+        deleted = prune_catalog_changes(older_than)
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей журнала: {deleted}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.ratelimit import prune_buckets
+
+
+class Command(BaseCommand):
+    help = 'Удаляет давно не используемые корзины ограничителя запросов'
+
+    def handle(self, *args, **options):
+        deleted = prune_buckets()
+        self.stdout.write(self.style.SUCCESS(f'Удалено корзин: {deleted}'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from foodcartapp.models import Product, sync_menu_changes
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает и проверяет число ресторанов, в которых товар в продаже'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить счётчики, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            mismatched = list(
+                Product.objects
+                .with_actual_availability()
+                .exclude(available_restaurants_count=F('actual_restaurants_count'))
+                .values_list('id', 'name', 'available_restaurants_count', 'actual_restaurants_count')
+            )
+            for product_id, name, stored, actual in mismatched:
+                self.stdout.write(f'{name} (id={product_id}): сохранено {stored}, на самом деле {actual}')
+
+            if not mismatched:
+                self.stdout.write(self.style.SUCCESS('Счётчики доступности товаров в порядке'))
+                return
+
+            if options['check']:
+                raise CommandError(f'Расхождений: {len(mismatched)}')
+
+            sync_menu_changes(product_id for product_id, *_ in mismatched)
+            self.stdout.write(self.style.SUCCESS(f'Исправлено товаров: {len(mismatched)}'))
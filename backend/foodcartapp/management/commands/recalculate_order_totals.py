@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Проверяет и пересчитывает сохранённую стоимость заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить стоимость, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            mismatched = list(
+                Order.objects
+                .with_actual_total_price()
+                .exclude(total_price=F('actual_total_price'))
+                .values_list('id', 'total_price', 'actual_total_price')
+            )
+            for order_id, stored, actual in mismatched:
+                self.stdout.write(f'Заказ {order_id}: сохранено {stored}, на самом деле {actual}')
+
+            if not mismatched:
+                self.stdout.write(self.style.SUCCESS('Стоимость заказов в порядке'))
+                return
+
+            if options['check']:
+                raise CommandError(f'Расхождений: {len(mismatched)}')
+
+            Order.objects.filter(pk__in=[order_id for order_id, *_ in mismatched]).refresh_total_price()
+            self.stdout.write(self.style.SUCCESS(f'Исправлено заказов: {len(mismatched)}'))
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_available_restaurants_count(apps, schema_editor):
+    Product = apps.get_model('foodcartapp', 'Product')
+    RestaurantMenuItem = apps.get_model('foodcartapp', 'RestaurantMenuItem')
+    Product.objects.update(
+        available_restaurants_count=Coalesce(
+            Subquery(
+                RestaurantMenuItem.objects
+                .filter(product=OuterRef('pk'), availability=True)
+                .values('product')
+                .annotate(count=Count('pk'))
+                .values('count')
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0047_catalogversion_catalogchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_restaurants_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='доступен в ресторанах'),
+        ),
+        migrations.RunPython(fill_available_restaurants_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import migrations
+
+BANNERS = [
+    ('Burger', 'burger.jpg', 'Tasty Burger at your door step'),
+    ('Spices', 'food.jpg', 'All Cuisines'),
+    ('New York', 'tasty.jpg', 'Food is incomplete without a tasty dessert'),
+]
+
+
+def create_banners(apps, schema_editor):
+    # Уменьшенные копии здесь не готовятся: у исторической модели нет
+    # сигналов, их создаёт команда generate_renditions после миграций
+    Banner = apps.get_model('foodcartapp', 'Banner')
+    if Banner.objects.exists():
+        return
+
+    for order, (title, filename, text) in enumerate(BANNERS):
+        path = os.path.join(settings.BASE_DIR, 'assets', filename)
+        if not os.path.exists(path):
+            continue
+        banner = Banner(title=title, text=text, order=order)
+        name = banner.image.field.generate_filename(banner, filename)
+        if default_storage.exists(name):
+            # Файл уже скопирован прошлым запуском миграций (например,
+            # при создании тестовой базы), повторно его не копируем
+            banner.image.name = name
+        else:
+            with open(path, 'rb') as image:
+                banner.image.save(filename, File(image), save=False)
+        banner.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0049_banner'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_banners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0050_move_banners_to_db'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banner',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='уменьшенные копии'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='уменьшенные копии'),
+        ),
+    ]
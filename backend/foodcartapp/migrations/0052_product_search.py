@@ -0,0 +1,41 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:20
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+FILL_SEARCH_VECTOR = '''
+    UPDATE foodcartapp_product AS product
+    SET search_vector =
+        setweight(to_tsvector('russian', product.name), 'A')
+        || setweight(to_tsvector('russian', coalesce(
+            (SELECT name FROM foodcartapp_productcategory WHERE id = product.category_id), ''
+        )), 'B')
+        || setweight(to_tsvector('russian', product.description), 'C')
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0051_image_renditions'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='product_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunSQL(FILL_SEARCH_VECTOR, migrations.RunSQL.noop),
+    ]
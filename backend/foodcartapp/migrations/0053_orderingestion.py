@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:22
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0052_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderIngestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Номер обращения')),
+                ('payload', models.JSONField(verbose_name='Данные заказа')),
+                ('status', models.CharField(choices=[('new', 'В очереди'), ('done', 'Заказ создан'), ('err', 'Ошибка')], db_index=True, default='new', max_length=4, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Принят')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Обработан')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingestions', to='foodcartapp.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'входящий заказ',
+                'verbose_name_plural': 'входящие заказы',
+            },
+        ),
+    ]
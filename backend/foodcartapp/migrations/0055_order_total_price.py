@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:24
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_total_price(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    OrderItem = apps.get_model('foodcartapp', 'OrderItem')
+    Order.objects.update(
+        total_price=Coalesce(
+            Subquery(
+                OrderItem.objects
+                .filter(order=OuterRef('pk'))
+                .values('order')
+                .annotate(total=Sum(F('price') * F('quantity'), output_field=models.DecimalField()))
+                .values('total')
+            ),
+            Value(0),
+            output_field=models.DecimalField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0054_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Стоимость заказа'),
+        ),
+        migrations.RunPython(fill_total_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0055_order_total_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogversion',
+            name='pruned_through',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='журнал очищен до версии'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:08
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0057_orderitem_quantity_max'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['description'], name='product_description_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0059_orderitem_quantity_no_max'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='Ключ')),
+                ('tokens', models.FloatField(verbose_name='Жетоны')),
+                ('refilled_at', models.FloatField(db_index=True, verbose_name='Пополнена')),
+            ],
+            options={
+                'verbose_name': 'корзина ограничителя запросов',
+                'verbose_name_plural': 'корзины ограничителя запросов',
+            },
+        ),
+    ]
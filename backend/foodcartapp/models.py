@@ -1,9 +1,23 @@
-from django.db import models
+import uuid
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+    TrigramWordSimilarity,
+)
+from django.db import models, transaction
 from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
 
 from phonenumber_field.modelfields import PhoneNumberField
-from django.db.models import Sum, F
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .renditions import get_rendition_url
 
 
 class Restaurant(models.Model):
@@ -30,14 +44,71 @@ class Restaurant(models.Model):
         return self.name
 
 
+SEARCH_CONFIG = 'russian'
+
+
+def count_available_menu_items():
+    return Coalesce(
+        Subquery(
+            RestaurantMenuItem.objects
+            .filter(product=OuterRef('pk'), availability=True)
+            .values('product')
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
 class ProductQuerySet(models.QuerySet):
     def available(self):
-        products = (
-            RestaurantMenuItem.objects
-            .filter(availability=True)
-            .values_list('product')
+        return self.filter(available_restaurants_count__gt=0)
+
+    def with_actual_availability(self):
+        return self.annotate(actual_restaurants_count=count_available_menu_items())
+
+    def refresh_availability(self):
+        # Строки товаров блокируются до пересчёта: иначе две транзакции,
+        # поменявшие разные пункты меню, посчитают каждая по своему снимку
+        # и последняя запишет счётчик без изменений другой
+        with transaction.atomic(using=self.db):
+            list(self.select_for_update().order_by('pk').values_list('pk', flat=True))
+            return self.update(available_restaurants_count=count_available_menu_items())
+
+    def refresh_search_vector(self):
+        category_name = Subquery(
+            ProductCategory.objects
+            .filter(pk=OuterRef('category_id'))
+            .values('name')[:1]
+        )
+        return self.update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector(Coalesce(category_name, Value('')), weight='B', config=SEARCH_CONFIG)
+                + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+            )
+        )
+
+    def search(self, text):
+        # Полнотекстовый поиск со стеммингом находит словоформы,
+        # триграммы по названию и описанию — опечатки. Все условия идут
+        # по GIN-индексам. Совпадение в описании весит вдвое меньше, чтобы
+        # не обгонять совпадение в названии. Категории ищутся только
+        # полнотекстово: их названия короткие и уже есть в search_vector
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        return (
+            self.filter(
+                Q(search_vector=query)
+                | Q(name__trigram_word_similar=text)
+                | Q(description__trigram_word_similar=text)
+            )
+            .annotate(search_rank=Greatest(
+                SearchRank(F('search_vector'), query),
+                TrigramWordSimilarity(text, 'name'),
+                TrigramWordSimilarity(text, 'description') * 0.5,
+            ))
+            .order_by('-search_rank', 'id')
         )
-        return self.filter(pk__in=products)
 
 
 class ProductCategory(models.Model):
@@ -76,6 +147,12 @@ class Product(models.Model):
     image = models.ImageField(
         'картинка'
     )
+    image_renditions = models.JSONField(
+        'уменьшенные копии',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     special_status = models.BooleanField(
         'спец.предложение',
         default=False,
@@ -86,16 +163,91 @@ class Product(models.Model):
         max_length=200,
         blank=True,
     )
+    # Денормализованный счётчик, поддерживается при записи пунктов меню
+    available_restaurants_count = models.PositiveIntegerField(
+        'доступен в ресторанах',
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
 
     objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'товар'
         verbose_name_plural = 'товары'
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx'),
+            GinIndex(fields=['description'], opclasses=['gin_trgm_ops'], name='product_description_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Счётчик пишут только сигналы меню и rebuild_product_availability.
+        # Обычное сохранение не должно затирать его значением,
+        # прочитанным вместе с объектом
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Как и сам Django, отложенные поля объекта из .only() не сохраняем
+            deferred_fields = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name != 'available_restaurants_count'
+                and field.attname not in deferred_fields
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def image_thumbnail_url(self):
+        return get_rendition_url(self.image, self.image_renditions, 'thumbnail')
+
+
+def sync_menu_changes(product_ids, restaurant_ids=()):
+    from .catalog import invalidate_restaurant_menus, record_catalog_changes
+
+    product_ids = set(product_ids)
+    with transaction.atomic():
+        if product_ids:
+            Product.objects.filter(pk__in=product_ids).refresh_availability()
+            record_catalog_changes(product_ids)
+        invalidate_restaurant_menus(restaurant_ids)
+
+
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    # Массовые операции обходят сигналы, поэтому счётчики доступности
+    # товаров и меню ресторанов обновляются здесь же, в той же транзакции.
+    # bulk_update выполняется через update и тоже попадает сюда
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            items = list(self.values_list('pk', 'restaurant_id', 'product_id'))
+            rows = super().update(**kwargs)
+            if {'product', 'product_id', 'restaurant', 'restaurant_id'} & set(kwargs):
+                items += RestaurantMenuItem.objects.filter(
+                    pk__in=[pk for pk, *_ in items]
+                ).values_list('pk', 'restaurant_id', 'product_id')
+            sync_menu_changes(
+                product_ids=[product_id for *_, product_id in items],
+                restaurant_ids=[restaurant_id for _, restaurant_id, _ in items],
+            )
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            sync_menu_changes(
+                product_ids=[obj.product_id for obj in objs],
+                restaurant_ids=[obj.restaurant_id for obj in objs],
+            )
+        return objs
+
 
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
@@ -116,6 +268,8 @@ class RestaurantMenuItem(models.Model):
         db_index=True
     )
 
+    objects = RestaurantMenuItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'пункт меню ресторана'
         verbose_name_plural = 'пункты меню ресторана'
@@ -127,15 +281,134 @@ class RestaurantMenuItem(models.Model):
         return f"{self.restaurant.name} - {self.product.name}"
 
 
-class OrderManager(models.Manager):
-    def get_total_price(self):
-        return self.annotate(
-            total_price=models.Sum(
-                F('items__price') * F('items__quantity')
-            )
+class BannerQuerySet(models.QuerySet):
+    def active(self, now=None):
+        now = now or timezone.now()
+        return self.filter(
+            Q(starts_at__isnull=True) | Q(starts_at__lte=now),
+            Q(ends_at__isnull=True) | Q(ends_at__gt=now),
+            is_active=True,
         )
 
 
+class Banner(models.Model):
+    title = models.CharField(
+        'заголовок',
+        max_length=50,
+    )
+    text = models.CharField(
+        'текст',
+        max_length=200,
+        blank=True,
+    )
+    image = models.ImageField(
+        'картинка',
+        upload_to='banners',
+    )
+    image_renditions = models.JSONField(
+        'уменьшенные копии',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    order = models.PositiveIntegerField(
+        'порядок',
+        default=0,
+        db_index=True,
+    )
+    is_active = models.BooleanField(
+        'показывать',
+        default=True,
+        db_index=True,
+    )
+    starts_at = models.DateTimeField(
+        'начало показа',
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+    ends_at = models.DateTimeField(
+        'конец показа',
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+
+    objects = BannerQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'баннер'
+        verbose_name_plural = 'баннеры'
+        ordering = ['order', 'id']
+
+    def __str__(self):
+        return self.title
+
+
+class CatalogVersion(models.Model):
+    value = models.PositiveBigIntegerField(
+        'версия',
+        default=0,
+    )
+    # Изменения до этой версии включительно уже удалены из журнала
+    pruned_through = models.PositiveBigIntegerField(
+        'журнал очищен до версии',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'версия каталога'
+        verbose_name_plural = 'версии каталога'
+
+    def __str__(self):
+        return str(self.value)
+
+
+class CatalogChange(models.Model):
+    version = models.PositiveBigIntegerField(
+        'версия каталога',
+        db_index=True,
+    )
+    # Не ForeignKey: запись должна пережить удаление товара
+    product_id = models.PositiveIntegerField(
+        'id товара',
+        db_index=True,
+    )
+    changed_at = models.DateTimeField(
+        'время изменения',
+        default=timezone.now,
+    )
+
+    class Meta:
+        verbose_name = 'изменение каталога'
+        verbose_name_plural = 'изменения каталога'
+
+    def __str__(self):
+        return f"{self.version}: {self.product_id}"
+
+
+def sum_order_items():
+    return Coalesce(
+        Subquery(
+            OrderItem.objects
+            .filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Sum(F('price') * F('quantity'), output_field=models.DecimalField()))
+            .values('total')
+        ),
+        Value(0),
+        output_field=models.DecimalField(),
+    )
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_actual_total_price(self):
+        return self.annotate(actual_total_price=sum_order_items())
+
+    def refresh_total_price(self):
+        return self.update(total_price=sum_order_items())
+
+
 class Order(models.Model):
     UNPROCESSING = 'new'
     PROCESSING = 'prc'
@@ -155,7 +428,7 @@ class Order(models.Model):
         ('cash', 'Наличные'),
     ]
 
-    objects = OrderManager()
+    objects = OrderQuerySet.as_manager()
 
     firstname = models.CharField(
         verbose_name='Имя',
@@ -218,7 +491,15 @@ class Order(models.Model):
         blank=True,
         null=True,
     )
-    price = OrderManager()
+
+    total_price = models.DecimalField(
+        verbose_name='Стоимость заказа',
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'заказчик'
@@ -228,6 +509,118 @@ class Order(models.Model):
         return f"{self.firstname} {self.lastname} {self.address}"
 
 
+class OrderIngestion(models.Model):
+    PENDING = 'new'
+    DONE = 'done'
+    FAILED = 'err'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (DONE, 'Заказ создан'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    reference = models.UUIDField(
+        verbose_name='Номер обращения',
+        default=uuid.uuid4,
+        unique=True,
+        editable=False,
+    )
+    payload = models.JSONField(
+        verbose_name='Данные заказа'
+    )
+    status = models.CharField(
+        verbose_name='Статус',
+        max_length=4,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        db_index=True,
+    )
+    order = models.ForeignKey(
+        Order,
+        verbose_name='Заказ',
+        related_name='ingestions',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    error = models.TextField(
+        verbose_name='Ошибка',
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Принят', default=timezone.now, db_index=True
+    )
+    processed_at = models.DateTimeField(
+        verbose_name='Обработан', null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = 'входящий заказ'
+        verbose_name_plural = 'входящие заказы'
+
+    def __str__(self):
+        return f"{self.reference} {self.get_status_display()}"
+
+
+class IdempotencyKey(models.Model):
+    key = models.CharField(
+        verbose_name='Ключ',
+        max_length=255,
+        unique=True,
+    )
+    request_fingerprint = models.CharField(
+        verbose_name='Отпечаток запроса',
+        max_length=64,
+    )
+    response_status = models.PositiveSmallIntegerField(
+        verbose_name='Код ответа',
+        null=True,
+    )
+    response_body = models.JSONField(
+        verbose_name='Тело ответа',
+        encoder=DjangoJSONEncoder,
+        null=True,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Создан', default=timezone.now
+    )
+    expires_at = models.DateTimeField(
+        verbose_name='Действует до', db_index=True
+    )
+
+    class Meta:
+        verbose_name = 'ключ идемпотентности'
+        verbose_name_plural = 'ключи идемпотентности'
+
+    def __str__(self):
+        return self.key
+
+
+class RateLimitBucket(models.Model):
+    # Корзины ограничителя запросов лежат в базе, поэтому они общие
+    # для всех воркеров gunicorn. Время хранится в секундах эпохи,
+    # как его возвращает time.time()
+    key = models.CharField(
+        verbose_name='Ключ',
+        max_length=255,
+        unique=True,
+    )
+    tokens = models.FloatField(
+        verbose_name='Жетоны',
+    )
+    refilled_at = models.FloatField(
+        verbose_name='Пополнена',
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = 'корзина ограничителя запросов'
+        verbose_name_plural = 'корзины ограничителя запросов'
+
+    def __str__(self):
+        return self.key
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(
         Order,
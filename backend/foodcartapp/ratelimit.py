@@ -0,0 +1,155 @@
+import math
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Least
+from django.http import JsonResponse
+
+from .models import RateLimitBucket
+
+CHECKOUT = 'checkout'
+CATALOG = 'catalog'
+STATUS = 'status'
+
+# Префиксы проверяются по порядку: опрос статуса заказа из очереди
+# не должен расходовать жетоны оформления заказов
+ENDPOINT_LANES = [
+    ('/api/order/ingestions/', STATUS),
+    ('/api/order/', CHECKOUT),
+    ('/api/orders/', CHECKOUT),
+    ('/api/products/', CATALOG),
+    ('/api/restaurants/', CATALOG),
+    ('/api/banners/', CATALOG),
+]
+
+REFILLED_TOKENS = (
+    'LEAST(%(capacity)s, bucket.tokens'
+    ' + GREATEST(EXCLUDED.refilled_at - bucket.refilled_at, 0) * %(rate)s)'
+)
+
+# Пополнение и списание жетона идут одним запросом: строка корзины
+# блокируется только на время INSERT ... ON CONFLICT DO UPDATE, а условие
+# WHERE проверяется уже на заблокированной строке. Если жетонов не хватает,
+# строка не меняется и запрос ничего не возвращает
+TAKE_TOKEN_SQL = f'''
+    INSERT INTO {RateLimitBucket._meta.db_table} AS bucket (key, tokens, refilled_at)
+    VALUES (%(key)s, %(capacity)s - 1, %(now)s)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = {REFILLED_TOKENS} - 1,
+        refilled_at = GREATEST(bucket.refilled_at, EXCLUDED.refilled_at)
+    WHERE {REFILLED_TOKENS} >= 1 + %(reserve)s
+    RETURNING tokens
+'''
+
+
+@dataclass
+class Bucket:
+    rate: float
+    capacity: float
+
+    # Классическая корзина жетонов: capacity жетонов, rate жетонов в секунду.
+    # Состояние лежит в RateLimitBucket, поэтому лимиты общие для всех воркеров
+    def take(self, key, reserve=0):
+        # Возвращает 0, если жетон списан, иначе через сколько секунд повторить
+        if self.capacity < 1 + reserve:
+            return math.ceil(self.capacity / self.rate)
+        now = time.time()
+        with connection.cursor() as cursor:
+            cursor.execute(TAKE_TOKEN_SQL, {
+                'key': key,
+                'capacity': self.capacity,
+                'rate': self.rate,
+                'reserve': reserve,
+                'now': now,
+            })
+            if cursor.fetchone():
+                return 0
+
+        bucket = RateLimitBucket.objects.filter(key=key).values('tokens', 'refilled_at').first()
+        if bucket is None:
+            return 1
+        tokens = min(self.capacity, bucket['tokens'] + max(now - bucket['refilled_at'], 0) * self.rate)
+        return math.ceil((1 + reserve - tokens) / self.rate)
+
+    def give_back(self, key):
+        RateLimitBucket.objects.filter(key=key).update(
+            tokens=Least(F('tokens') + 1, self.capacity),
+        )
+
+    @property
+    def refill_time(self):
+        return self.capacity / self.rate
+
+
+def get_client_buckets():
+    return {
+        lane: Bucket(rate, capacity)
+        for lane, (rate, capacity) in settings.RATE_LIMITS.items()
+    }
+
+
+def get_total_bucket():
+    return Bucket(*settings.RATE_LIMIT_TOTAL)
+
+
+def prune_buckets():
+    # Корзина, которую не трогали дольше полного пополнения, заполнена
+    # доверху. Удалить её то же самое, что создать заново
+    buckets = [*get_client_buckets().values(), get_total_bucket()]
+    refill_time = max(bucket.refill_time for bucket in buckets)
+    deleted, _ = RateLimitBucket.objects.filter(refilled_at__lt=time.time() - refill_time).delete()
+    return deleted
+
+
+def get_lane(path):
+    for prefix, lane in ENDPOINT_LANES:
+        if path.startswith(prefix):
+            return lane, prefix
+    return None, None
+
+
+def get_client_ip(request):
+    # За nginx адрес клиента приходит в X-Real-IP
+    return request.headers.get('X-Real-IP') or request.META.get('REMOTE_ADDR', '')
+
+
+def too_many_requests(retry_after, detail, status):
+    response = JsonResponse({'detail': detail}, status=status)
+    response['Retry-After'] = str(max(retry_after, 1))
+    return response
+
+
+class RateLimitMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.RATE_LIMIT_ENABLED
+        self.client_buckets = get_client_buckets()
+        self.total_bucket = get_total_bucket()
+        # Часть общей ёмкости держится только для оформления заказов:
+        # при перегрузке каталог и опрос статуса отсекаются первыми
+        self.checkout_reserve = self.total_bucket.capacity * settings.RATE_LIMIT_CHECKOUT_RESERVE
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+        lane, prefix = get_lane(request.path)
+        if lane is None:
+            return self.get_response(request)
+
+        client_key = f'ratelimit:{prefix}:{get_client_ip(request)}'
+        client_bucket = self.client_buckets[lane]
+        retry_after = client_bucket.take(client_key)
+        if retry_after:
+            return too_many_requests(retry_after, 'Слишком много запросов', 429)
+
+        reserve = 0 if lane == CHECKOUT else self.checkout_reserve
+        retry_after = self.total_bucket.take('ratelimit:total', reserve)
+        if retry_after:
+            # Запрос не выполнен, поэтому жетон клиента возвращается
+            client_bucket.give_back(client_key)
+            return too_many_requests(retry_after, 'Сервис перегружен, повторите позже', 503)
+
+        return self.get_response(request)
@@ -0,0 +1,121 @@
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Имя варианта -> максимальная сторона в пикселях
+PRODUCT_RENDITIONS = {
+    'thumbnail': 100,
+    'medium': 400,
+}
+BANNER_RENDITIONS = {
+    'medium': 800,
+    'large': 1600,
+}
+
+RENDITIONS_DIR = 'renditions'
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+def save_variant(storage, image, name, image_format, **params):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **params)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_renditions(field_file, sizes):
+    storage = field_file.storage
+    directory, filename = os.path.split(field_file.name)
+    stem = os.path.splitext(filename)[0]
+
+    with field_file.open('rb'):
+        original = ImageOps.exif_transpose(Image.open(field_file))
+        original.load()
+
+    # Картинки с прозрачностью сохраняем в PNG, остальные — в JPEG
+    has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+    original = original.convert('RGBA' if has_alpha else 'RGB')
+
+    variants = {}
+    for rendition, size in sizes.items():
+        image = original.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+        name = os.path.join(RENDITIONS_DIR, directory, f'{stem}_{rendition}')
+        if has_alpha:
+            fallback = save_variant(storage, image, f'{name}.png', 'PNG', optimize=True)
+        else:
+            fallback = save_variant(
+                storage, image, f'{name}.jpg', 'JPEG',
+                quality=JPEG_QUALITY, optimize=True, progressive=True,
+            )
+        variants[rendition] = {
+            'width': image.width,
+            'height': image.height,
+            'src': fallback,
+            'webp': save_variant(storage, image, f'{name}.webp', 'WEBP', quality=WEBP_QUALITY),
+        }
+    return {
+        'source': field_file.name,
+        'variants': variants,
+    }
+
+
+def delete_renditions(storage, renditions):
+    for variant in renditions.get('variants', {}).values():
+        for name in (variant['src'], variant['webp']):
+            storage.delete(name)
+
+
+def refresh_renditions(instance, sizes, force=False):
+    # Возвращает новые данные о вариантах или None, если обновлять нечего
+    renditions = instance.image_renditions or {}
+    if not instance.image:
+        return {} if renditions else None
+    if renditions.get('source') == instance.image.name and not force:
+        return None
+
+    try:
+        new_renditions = generate_renditions(instance.image, sizes)
+    except (OSError, UnidentifiedImageError) as error:
+        logger.error(f"Не удалось подготовить уменьшенные копии {instance.image.name}: {error}")
+        return None
+    delete_renditions(instance.image.storage, renditions)
+    return new_renditions
+
+
+def get_rendition_url(field_file, renditions, rendition, webp=False):
+    variant = (renditions or {}).get('variants', {}).get(rendition)
+    if not variant:
+        return field_file.url if field_file else ''
+    return field_file.storage.url(variant['webp' if webp else 'src'])
+
+
+def serialize_renditions(field_file, renditions):
+    variants = (renditions or {}).get('variants', {})
+    storage = field_file.storage
+    return {
+        rendition: {
+            'width': variant['width'],
+            'height': variant['height'],
+            'src': storage.url(variant['src']),
+            'webp': storage.url(variant['webp']),
+        }
+        for rendition, variant in variants.items()
+    }
+
+
+def build_srcset(field_file, renditions):
+    variants = sorted(
+        (renditions or {}).get('variants', {}).values(),
+        key=lambda variant: variant['width'],
+    )
+    storage = field_file.storage
+    return {
+        'default': ', '.join(f"{storage.url(variant['src'])} {variant['width']}w" for variant in variants),
+        'webp': ', '.join(f"{storage.url(variant['webp'])} {variant['width']}w" for variant in variants),
+    }
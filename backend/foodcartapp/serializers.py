@@ -1,85 +1,198 @@
 import logging
+from collections import defaultdict
+from collections.abc import Mapping
+from functools import partial
 
 from django.conf import settings
-from django.db.models import Count, Q
-from django.utils import timezone
+from django.db import transaction
 
-from geopy.distance import distance
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
+from rest_framework.settings import api_settings
 
+from places.addresses import normalize_address
+from places.distances import distance_matrix
 from places.models import Place
-from places.views import fetch_coordinates
-from .models import Order, OrderItem, Restaurant
+from places.services import geocode_addresses, register_order_addresses
+from .models import Order, OrderItem, Product, RestaurantMenuItem
 
 logger = logging.getLogger(__name__)
 
+PRODUCTS_CONTEXT_KEY = 'products_by_id'
+
+
+def parse_product_id(data):
+    # Номер товара принимается только целым числом или строкой из цифр:
+    # int() молча обрезал бы 1.9 до 1 и True до 1
+    if isinstance(data, int) and not isinstance(data, bool):
+        return data
+    if isinstance(data, str) and data.isascii() and data.isdigit():
+        return int(data)
+    return None
+
+
+def preload_products(serializer, orders_data):
+    # Все товары заказа или пакета заказов загружаются одним запросом in_bulk
+    # и кладутся в общий контекст сериализатора
+    context = serializer.context
+    if PRODUCTS_CONTEXT_KEY in context:
+        return
+
+    product_ids = set()
+    for order_data in orders_data:
+        if not isinstance(order_data, Mapping):
+            continue
+        products_data = order_data.get('products')
+        if not isinstance(products_data, list):
+            continue
+        for product_data in products_data:
+            if not isinstance(product_data, Mapping):
+                continue
+            product_id = parse_product_id(product_data.get('product'))
+            if product_id is not None:
+                product_ids.add(product_id)
+    context[PRODUCTS_CONTEXT_KEY] = Product.objects.in_bulk(product_ids)
+
+
+class ProductField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        products = self.context.get(PRODUCTS_CONTEXT_KEY)
+        if products is None:
+            return super().to_internal_value(data)
+
+        product_id = parse_product_id(data)
+        if product_id is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        product = products.get(product_id)
+        if product is None:
+            self.fail('does_not_exist', pk_value=data)
+        return product
+
 
 class OrderItemSerializer(ModelSerializer):
+    product = ProductField(queryset=Product.objects.all())
+
     class Meta:
         model = OrderItem
         fields = ['product', 'quantity']
 
 
+def calculate_total_price(products_data):
+    return sum(
+        product_data['product'].price * product_data['quantity']
+        for product_data in products_data
+    )
+
+
+def build_order_items(order, products_data):
+    # Цена фиксируется из карточки товара на момент заказа
+    return [
+        OrderItem(order=order, price=product_data['product'].price, **product_data)
+        for product_data in products_data
+    ]
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        # В отличие от обычного ListSerializer ошибки отдельных заказов
+        # не отменяют весь пакет: они копятся в item_errors по номеру заказа
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ['Ожидается список заказов']
+            })
+        if len(data) > settings.ORDER_BATCH_MAX_SIZE:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    f'Не больше {settings.ORDER_BATCH_MAX_SIZE} заказов за раз'
+                ]
+            })
+
+        preload_products(self, data)
+        self.item_errors = {}
+        validated_orders = []
+        for index, order_data in enumerate(data):
+            try:
+                validated_orders.append(self.child.run_validation(order_data))
+            except serializers.ValidationError as error:
+                self.item_errors[index] = error.detail
+        return validated_orders
+
+    def create(self, validated_data):
+        orders = []
+        orders_products = []
+        for order_data in validated_data:
+            order_data = dict(order_data)
+            products_data = order_data.pop('products')
+            orders_products.append(products_data)
+            orders.append(Order(total_price=calculate_total_price(products_data), **order_data))
+
+        # Все заказы и все их позиции вставляются двумя запросами
+        Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create([
+            order_item
+            for order, products_data in zip(orders, orders_products)
+            for order_item in build_order_items(order, products_data)
+        ])
+
+        # Адреса регистрируются уже после коммита, вне транзакции заказа
+        addresses = [order.address for order in orders]
+        transaction.on_commit(partial(register_order_addresses, addresses))
+
+        return orders
+
+
 class OrderSerializer(serializers.ModelSerializer):
     products = OrderItemSerializer(many=True, allow_empty=False, write_only=True)
 
     class Meta:
         model = Order
         fields = ['firstname', 'lastname', 'phonenumber', 'address', 'products']
+        list_serializer_class = OrderListSerializer
+
+    def to_internal_value(self, data):
+        preload_products(self, [data])
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        # Стоимость должна поместиться в Order.total_price, иначе база
+        # отклонит заказ уже при вставке
+        total_price_field = Order._meta.get_field('total_price')
+        max_total_price = 10 ** (total_price_field.max_digits - total_price_field.decimal_places)
+        if calculate_total_price(attrs['products']) >= max_total_price:
+            raise serializers.ValidationError({
+                'products': [f'Стоимость заказа должна быть меньше {max_total_price} ₽']
+            })
+        return attrs
 
     def create(self, validated_data):
         # Извлекаем продукты из validated_data, чтобы передать их отдельно
         products_data = validated_data.pop('products')
+        validated_data['total_price'] = calculate_total_price(products_data)
 
         # Используем super() для создания объекта Order без поля 'products'
         order = super(OrderSerializer, self).create(validated_data)
 
-        # Создаем элементы заказа (OrderItem) с привязкой к заказу
-        order_items = []
-        for product_data in products_data:
-            product = product_data['product']
-            price = product.price  # Получаем цену из модели Product
-            order_item = OrderItem(order=order, price=price, **product_data)
-            order_items.append(order_item)
-
-        # Создаем все элементы заказа за один запрос
-        OrderItem.objects.bulk_create(order_items)
-
-        # Обновляем или создаем Place (адрес)
-        try:
-            Place.objects.update_or_create(
-                address=order.address, defaults={"create_date": timezone.now()}
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении или создании места для адреса {order.address}: {str(e)}")
+        # Создаем все элементы заказа (OrderItem) за один запрос
+        OrderItem.objects.bulk_create(build_order_items(order, products_data))
+
+        # Адрес регистрируется уже после коммита, вне транзакции заказа
+        transaction.on_commit(partial(register_order_addresses, [order.address]))
 
         return order
 
 
 def update_or_create_place(address):
-    place, created = Place.objects.get_or_create(address=address)
-    if created or not place.latitude or not place.longitude:
-        location = fetch_coordinates(settings.YANDEX_GEOCODER_API_KEY, address)
-        if location:
-            longitude, latitude = location
-            place.longitude = longitude
-            place.latitude = latitude
-            place.save()
-        else:
-            logger.warning(f"Не удалось получить координаты для адреса {address} из API")
-    else:
-        logger.info(f"Координаты для адреса {address} загружены из базы данных")
+    # geocode_addresses сам создаёт недостающее место, повторный адрес берётся из кэша
+    if normalize_address(address) not in geocode_addresses([address]):
+        logger.warning(f"Не удалось получить координаты для адреса {address} из API")
 
 
 def get_coordinates(address, place_map, api_key):
-    place = place_map.get(address)
+    # place_map заполняется заранее через geocode_addresses
+    place = place_map.get(normalize_address(address))
     if place and place.latitude and place.longitude:
         return place.latitude, place.longitude
-    else:
-        update_or_create_place(address)
-        place = place_map.get(address)
-        return (place.latitude, place.longitude) if place else None
+    return None
 
 
 def process_restaurants(restaurants, place_map, api_key):
@@ -89,45 +202,97 @@ def process_restaurants(restaurants, place_map, api_key):
         if coordinates:
             restaurant_coordinates[restaurant.id] = coordinates
         else:
-            logger.warning(f"Не удалось получить координаты для ресторана {restaurant.name} из API")
+            logger.warning(f"Координаты ресторана {restaurant.name} пока не известны")
     return restaurant_coordinates
 
 
-def get_available_restaurants(order):
-    if order.restaurant:
-        return [order.restaurant]
-    else:
-        # Если ресторан не выбран, ищем подходящие рестораны
-        product_ids = order.items.values_list('product_id', flat=True)
-        return Restaurant.objects.annotate(
-            num_matching_products=Count(
-                'menu_items',
-                filter=Q(menu_items__product_id__in=product_ids) & Q(menu_items__availability=True)
+def get_capable_restaurant_ids(orders):
+    # Доступность меню для всех заказов загружается одним запросом.
+    # None — заказ без товаров, подходит любой ресторан
+    products_by_order = {order.id: {item.product_id for item in order.items.all()} for order in orders}
+    restaurants_by_product = defaultdict(set)
+    menu_items = (
+        RestaurantMenuItem.objects
+        .filter(product_id__in=set().union(*products_by_order.values()), availability=True)
+        .values_list('product_id', 'restaurant_id')
+    )
+    for product_id, restaurant_id in menu_items:
+        restaurants_by_product[product_id].add(restaurant_id)
+
+    capable_restaurant_ids = {}
+    for order in orders:
+        product_ids = products_by_order[order.id]
+        if order.restaurant_id:
+            capable_restaurant_ids[order.id] = {order.restaurant_id}
+        elif product_ids:
+            capable_restaurant_ids[order.id] = set.intersection(
+                *(restaurants_by_product[product_id] for product_id in product_ids)
             )
-        ).filter(num_matching_products=len(product_ids)).distinct() if product_ids else Restaurant.objects.all()
+        else:
+            capable_restaurant_ids[order.id] = None
+    return capable_restaurant_ids
 
 
-def process_orders(orders, restaurant_coordinates, place_map, api_key):
+def process_orders(orders, restaurant_index, place_map, api_key):
     available_restaurants_data = []
     orders_to_update = []  # Список для сбора заказов, которые нужно обновить
+    capable_restaurant_ids = get_capable_restaurant_ids(orders)
+
+    # Индекс отбирает для каждого заказа рестораны из ближних ячеек,
+    # а расстояния до всех отобранных считаются одной матрицей
+    located_orders = []
+    customer_coordinates = []
+    order_candidates = []
+    for order in orders:
+        coordinates = get_coordinates(order.address, place_map, api_key)
+        if not coordinates:
+            continue
+        restaurant_ids = capable_restaurant_ids[order.id]
+        if restaurant_ids is not None:
+            for restaurant_id in restaurant_ids:
+                if restaurant_id not in restaurant_index:
+                    logger.warning(
+                        f"Предупреждение: Нет координат для ресторана "
+                        f"{restaurant_index.names.get(restaurant_id, restaurant_id)}"
+                    )
+        located_orders.append(order)
+        customer_coordinates.append(coordinates)
+        order_candidates.append([
+            row
+            for row in restaurant_index.candidate_rows(*coordinates, radius_km=settings.DELIVERY_RADIUS_KM)
+            if restaurant_ids is None or restaurant_index.ids[row] in restaurant_ids
+        ])
+
+    columns = sorted(set().union(*order_candidates))
+    column_of_row = {row: column for column, row in enumerate(columns)}
+    if located_orders and columns:
+        distances = distance_matrix(customer_coordinates, restaurant_index.points[columns])
+
+    order_distances = {}
+    for order_row, (order, candidate_rows) in enumerate(zip(located_orders, order_candidates)):
+        nearest_restaurants = sorted(
+            (
+                (restaurant_index.ids[row], float(distances[order_row, column_of_row[row]]))
+                for row in candidate_rows
+            ),
+            key=lambda item: item[1],
+        )
+        if settings.DELIVERY_RADIUS_KM is not None:
+            nearest_restaurants = [
+                item for item in nearest_restaurants
+                if item[1] <= settings.DELIVERY_RADIUS_KM
+            ]
+        order_distances[order.id] = [
+            {
+                'name': restaurant_index.names[restaurant_id],
+                'distance': round(restaurant_distance, 2),
+            }
+            for restaurant_id, restaurant_distance in nearest_restaurants[:settings.NEAREST_RESTAURANTS_LIMIT]
+        ]
 
     for order in orders:
-        restaurant_distances = []
-        customer_coordinates = get_coordinates(order.address, place_map, api_key)
-        if customer_coordinates:
-            available_restaurants = get_available_restaurants(order)
-            for restaurant in available_restaurants:
-                if restaurant.id in restaurant_coordinates:
-                    restaurant_distance_value = round(distance(
-                        customer_coordinates,
-                        restaurant_coordinates[restaurant.id]).km, 2)
-                    restaurant_distances.append({
-                        'name': restaurant.name,
-                        'distance': restaurant_distance_value
-                    })
-                else:
-                    logger.warning(f"Предупреждение: Нет координат для ресторана {restaurant.name}")
-            restaurant_distances.sort(key=lambda x: x['distance'])
+        restaurant_distances = order_distances.get(order.id, [])
+        if order.id in order_distances:
             order.restaurant_distances = restaurant_distances
 
             # Проверяем, нужно ли обновить статус заказа
@@ -145,22 +310,14 @@ def process_orders(orders, restaurant_coordinates, place_map, api_key):
 
 
 def load_coordinates(addresses):
-    place_map = {place.address: place for place in Place.objects.filter(address__in=addresses)}
-    updated_places = []
-
-    for address in addresses:
-        update_or_create_place(address)
-        place = place_map.get(address)
-        if place:
-            updated_places.append(place)
-
-    return place_map, updated_places
+    place_map = geocode_addresses(addresses)
+    return place_map, list(place_map.values())
 
 
 def update_coordinates_on_address_change(instance, new_address):
     if instance.address != new_address:
         update_or_create_place(new_address)
-        place = Place.objects.get(address=new_address)
+        place = Place.objects.get(address_key=normalize_address(new_address))
         if place:
             instance.address = new_address
             instance.longitude = place.longitude
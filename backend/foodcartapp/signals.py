@@ -0,0 +1,90 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .banners import invalidate_banners
+from .catalog import record_catalog_changes
+from .models import (
+    Banner,
+    Product,
+    ProductCategory,
+    Restaurant,
+    RestaurantMenuItem,
+    sync_menu_changes,
+)
+from .renditions import BANNER_RENDITIONS, PRODUCT_RENDITIONS, refresh_renditions
+from .spatial import invalidate_restaurant_index
+
+
+# Уменьшенные копии готовятся раньше, чем сбрасываются кэши каталога и баннеров,
+# иначе кэш успеет собраться со ссылками на старые копии
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Banner)
+def update_image_renditions(sender, instance, **kwargs):
+    sizes = BANNER_RENDITIONS if sender is Banner else PRODUCT_RENDITIONS
+    renditions = refresh_renditions(instance, sizes)
+    if renditions is not None:
+        instance.image_renditions = renditions
+        sender.objects.filter(pk=instance.pk).update(image_renditions=renditions)
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_vector(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.pk).refresh_search_vector()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def track_product_change(sender, instance, **kwargs):
+    record_catalog_changes([instance.id])
+
+
+@receiver(post_save, sender=ProductCategory)
+@receiver(pre_delete, sender=ProductCategory)
+def track_category_change(sender, instance, **kwargs):
+    # При удалении категории товары отвязываются через UPDATE без сигналов,
+    # поэтому их id собираются до удаления
+    instance._product_ids = list(instance.products.values_list('id', flat=True))
+    record_catalog_changes(instance._product_ids)
+
+
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def update_category_search_vectors(sender, instance, **kwargs):
+    Product.objects.filter(pk__in=instance._product_ids).refresh_search_vector()
+
+
+@receiver(pre_save, sender=RestaurantMenuItem)
+def remember_menu_item_links(sender, instance, **kwargs):
+    # Пункт меню могли перепривязать к другому товару или ресторану —
+    # тогда пересчитать нужно и старые, и новые
+    instance._previous_links = (
+        RestaurantMenuItem.objects
+        .filter(pk=instance.pk)
+        .values_list('restaurant_id', 'product_id')
+        .first()
+    ) if instance.pk else None
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def sync_menu_item(sender, instance, **kwargs):
+    restaurant_ids = {instance.restaurant_id}
+    product_ids = {instance.product_id}
+    previous_links = getattr(instance, '_previous_links', None)
+    if previous_links:
+        previous_restaurant_id, previous_product_id = previous_links
+        restaurant_ids.add(previous_restaurant_id)
+        product_ids.add(previous_product_id)
+    sync_menu_changes(product_ids, restaurant_ids)
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def reset_banners(sender, **kwargs):
+    invalidate_banners()
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def reset_restaurant_index(sender, **kwargs):
+    invalidate_restaurant_index()
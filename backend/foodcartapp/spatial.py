@@ -0,0 +1,187 @@
+import math
+import threading
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from places.addresses import normalize_address
+from places.cache import GENERATION_KEY as PLACES_GENERATION_KEY
+from places.distances import distance_matrix
+from places.services import get_known_places, register_order_addresses
+from .models import Restaurant
+from .serializers import process_restaurants
+
+INDEX_VERSION_KEY = 'foodcartapp:restaurant_index_version'
+
+KM_PER_DEGREE = 111.32
+# Проекция на плоскость немного искажает расстояния, поэтому оценка снизу берётся с запасом
+BOUND_SAFETY = 0.9
+
+
+class RestaurantIndex:
+    # Равномерная сетка над координатами ресторанов: поиск ближайших идёт
+    # кольцами ячеек от точки заказа и останавливается, как только
+    # следующее кольцо заведомо дальше найденного
+    def __init__(self, restaurant_coordinates, restaurant_names, cell_km):
+        self.cell_km = cell_km
+        self.names = restaurant_names
+        self.ids = list(restaurant_coordinates)
+        self.rows = {restaurant_id: row for row, restaurant_id in enumerate(self.ids)}
+        self.points = np.array(
+            [[float(lat), float(lon)] for lat, lon in restaurant_coordinates.values()],
+            dtype=float,
+        ).reshape(-1, 2)
+        self.reference_lat = float(self.points[:, 0].mean()) if len(self.ids) else 0.0
+
+        self.cells = {}
+        for row, (lat, lon) in enumerate(self.points):
+            self.cells.setdefault(self.get_cell(lat, lon), []).append(row)
+
+    def __contains__(self, restaurant_id):
+        return restaurant_id in self.rows
+
+    def get_cell(self, lat, lon):
+        x = lon * KM_PER_DEGREE * math.cos(math.radians(self.reference_lat))
+        y = lat * KM_PER_DEGREE
+        return math.floor(x / self.cell_km), math.floor(y / self.cell_km)
+
+    def get_ring_cells(self, center, ring):
+        cx, cy = center
+        if ring == 0:
+            return [center]
+        cells = []
+        for dx in range(-ring, ring + 1):
+            cells.append((cx + dx, cy - ring))
+            cells.append((cx + dx, cy + ring))
+        for dy in range(-ring + 1, ring):
+            cells.append((cx - ring, cy + dy))
+            cells.append((cx + ring, cy + dy))
+        return cells
+
+    def nearest(self, lat, lon, k=None, radius_km=None, restaurant_ids=None):
+        # Возвращает [(id ресторана, расстояние в км)] по возрастанию расстояния
+        if not self.ids:
+            return []
+        lat, lon = float(lat), float(lon)
+        center = self.get_cell(lat, lon)
+        max_ring = max(
+            max(abs(cx - center[0]), abs(cy - center[1]))
+            for cx, cy in self.cells
+        )
+
+        found = []
+        for ring in range(max_ring + 1):
+            bound = max(ring - 1, 0) * self.cell_km * BOUND_SAFETY
+            if radius_km is not None and bound > radius_km:
+                break
+            if k is not None and len(found) >= k and found[k - 1][1] <= bound:
+                break
+
+            if 8 * ring > len(self.cells):
+                # Перебирать пустые ячейки дороже, чем досчитать все оставшиеся
+                rows = [
+                    row
+                    for (cx, cy), cell_rows in self.cells.items()
+                    if max(abs(cx - center[0]), abs(cy - center[1])) >= ring
+                    for row in cell_rows
+                ]
+                found.extend(self.measure(lat, lon, rows, restaurant_ids))
+                found.sort(key=lambda item: item[1])
+                break
+
+            rows = [
+                row
+                for cell in self.get_ring_cells(center, ring)
+                for row in self.cells.get(cell, ())
+            ]
+            found.extend(self.measure(lat, lon, rows, restaurant_ids))
+            found.sort(key=lambda item: item[1])
+
+        if radius_km is not None:
+            found = [item for item in found if item[1] <= radius_km]
+        return found[:k] if k is not None else found
+
+    def candidate_rows(self, lat, lon, radius_km=None):
+        # Строки ресторанов из ячеек, которые могут оказаться ближе radius_km;
+        # расстояния не считаются, их потом считают одной матрицей для всех заказов
+        if radius_km is None:
+            return list(range(len(self.ids)))
+        center = self.get_cell(float(lat), float(lon))
+        reach = math.floor(radius_km / (self.cell_km * BOUND_SAFETY)) + 1
+        return [
+            row
+            for (cx, cy), cell_rows in self.cells.items()
+            if max(abs(cx - center[0]), abs(cy - center[1])) <= reach
+            for row in cell_rows
+        ]
+
+    def measure(self, lat, lon, rows, restaurant_ids):
+        if restaurant_ids is not None:
+            rows = [row for row in rows if self.ids[row] in restaurant_ids]
+        if not rows:
+            return []
+        distances = distance_matrix([(lat, lon)], self.points[rows])[0]
+        return [(self.ids[row], float(distance)) for row, distance in zip(rows, distances)]
+
+
+def build_restaurant_index():
+    # Индекс строится только по уже известным координатам: сборка идёт
+    # в запросе, и ждать геокодер здесь нельзя. Новые адреса геокодируются
+    # в фоне и попадут в индекс при следующей пересборке
+    restaurants = list(Restaurant.objects.only('id', 'name', 'address'))
+    place_map = get_known_places(restaurant.address for restaurant in restaurants)
+    missing_addresses = [
+        restaurant.address for restaurant in restaurants
+        if normalize_address(restaurant.address) not in place_map
+    ]
+    if missing_addresses:
+        register_order_addresses(missing_addresses)
+    return RestaurantIndex(
+        process_restaurants(restaurants, place_map, None),
+        {restaurant.id: restaurant.name for restaurant in restaurants},
+        settings.RESTAURANT_INDEX_CELL_KM,
+    )
+
+
+_index = None
+_index_tokens = None
+_index_built_at = 0
+_index_building = False
+_index_lock = threading.Lock()
+
+
+def get_restaurant_index():
+    # Индекс живёт в памяти воркера и пересобирается, когда меняются рестораны
+    # или координаты мест, а также по истечении RESTAURANT_INDEX_TTL.
+    # Сборка идёт вне блокировки: пока один поток собирает новый индекс,
+    # остальные получают прежний, а не ждут
+    global _index, _index_tokens, _index_built_at, _index_building
+    tokens = caches[settings.VERSION_CACHE].get_many([INDEX_VERSION_KEY, PLACES_GENERATION_KEY])
+    with _index_lock:
+        expired = time.monotonic() - _index_built_at > settings.RESTAURANT_INDEX_TTL
+        if _index is not None and (tokens == _index_tokens and not expired or _index_building):
+            return _index
+        _index_building = True
+
+    try:
+        index = build_restaurant_index()
+    except Exception:
+        with _index_lock:
+            _index_building = False
+        raise
+
+    with _index_lock:
+        _index = index
+        _index_tokens = tokens
+        _index_built_at = time.monotonic()
+        _index_building = False
+    return index
+
+
+def invalidate_restaurant_index():
+    versions_cache = caches[settings.VERSION_CACHE]
+    transaction.on_commit(lambda: versions_cache.set(INDEX_VERSION_KEY, uuid.uuid4().hex, None))
@@ -0,0 +1,936 @@
+import importlib
+import json
+import math
+import os
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from random import Random
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from places.distances import distance_matrix
+from places.models import Place
+
+from .banners import get_banners_content
+from .catalog import iter_catalog_json, prune_catalog_changes
+from .ingestion import process_ingestion_batch
+from .models import (
+    Banner,
+    CatalogChange,
+    CatalogVersion,
+    Order,
+    OrderIngestion,
+    OrderItem,
+    Product,
+    RateLimitBucket,
+    Restaurant,
+    RestaurantMenuItem,
+    sync_menu_changes,
+)
+from .ratelimit import STATUS, Bucket, get_lane, prune_buckets
+from .renditions import (
+    PRODUCT_RENDITIONS,
+    build_srcset,
+    generate_renditions,
+    get_rendition_url,
+    refresh_renditions,
+    serialize_renditions,
+)
+from .serializers import OrderListSerializer, OrderSerializer, process_orders
+from .spatial import INDEX_VERSION_KEY, RestaurantIndex, get_restaurant_index
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+def use_temporary_media(test):
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    media_settings = override_settings(MEDIA_ROOT=directory.name)
+    media_settings.enable()
+    test.addCleanup(media_settings.disable)
+
+
+def build_image(name='burger.jpg', size=(600, 400), mode='RGB', image_format='JPEG'):
+    buffer = BytesIO()
+    Image.new(mode, size, 'orange').save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+def create_available_product(restaurant, **fields):
+    product = Product.objects.create(**{'price': 100, 'image': build_image(), **fields})
+    RestaurantMenuItem.objects.create(restaurant=restaurant, product=product)
+    product.refresh_from_db()
+    return product
+
+
+class RenditionsTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        use_temporary_media(self)
+
+    def open_variant(self, name):
+        with default_storage.open(name) as variant_file:
+            image = Image.open(variant_file)
+            image.load()
+        return image
+
+    def test_product_image_gets_jpeg_and_webp_renditions(self):
+        product = Product.objects.create(name='Бургер', price=100, image=build_image(size=(600, 400)))
+        product.refresh_from_db()
+        renditions = product.image_renditions
+
+        self.assertEqual(renditions['source'], product.image.name)
+        self.assertEqual(set(renditions['variants']), set(PRODUCT_RENDITIONS))
+        for rendition, size in PRODUCT_RENDITIONS.items():
+            variant = renditions['variants'][rendition]
+            # Пропорции сохраняются, большая сторона равна размеру варианта
+            self.assertEqual((variant['width'], variant['height']), (size, round(size * 2 / 3)))
+            self.assertEqual(self.open_variant(variant['src']).format, 'JPEG')
+            self.assertEqual(self.open_variant(variant['webp']).format, 'WEBP')
+            self.assertEqual(self.open_variant(variant['webp']).size, (variant['width'], variant['height']))
+
+    def test_transparent_image_falls_back_to_png(self):
+        product = Product(image=build_image('logo.png', size=(200, 200), mode='RGBA', image_format='PNG'))
+        product.image.save('logo.png', product.image.file, save=False)
+
+        renditions = generate_renditions(product.image, {'small': 50})
+        variant = renditions['variants']['small']
+        self.assertTrue(variant['src'].endswith('.png'))
+        self.assertEqual(self.open_variant(variant['src']).mode, 'RGBA')
+        self.assertEqual((variant['width'], variant['height']), (50, 50))
+
+    def test_small_image_is_not_upscaled(self):
+        product = Product.objects.create(name='Бургер', price=100, image=build_image(size=(80, 60)))
+        product.refresh_from_db()
+        medium = product.image_renditions['variants']['medium']
+        self.assertEqual((medium['width'], medium['height']), (80, 60))
+
+    def test_serialize_renditions_and_srcset(self):
+        product = Product.objects.create(name='Бургер', price=100, image=build_image(size=(600, 400)))
+        product.refresh_from_db()
+        variants = product.image_renditions['variants']
+        thumbnail_url = f"/media/{variants['thumbnail']['src']}"
+        medium_webp_url = f"/media/{variants['medium']['webp']}"
+
+        serialized = serialize_renditions(product.image, product.image_renditions)
+        self.assertEqual(serialized['thumbnail']['src'], thumbnail_url)
+        self.assertEqual(serialized['medium']['webp'], medium_webp_url)
+        self.assertEqual(serialized['medium']['width'], 400)
+
+        srcset = build_srcset(product.image, product.image_renditions)
+        self.assertEqual(srcset['default'].split(', ')[0], f'{thumbnail_url} 100w')
+        self.assertEqual(srcset['webp'].split(', ')[1], f'{medium_webp_url} 400w')
+        self.assertEqual(build_srcset(product.image, {}), {'default': '', 'webp': ''})
+
+        self.assertEqual(product.image_thumbnail_url, thumbnail_url)
+        self.assertEqual(get_rendition_url(product.image, {}, 'thumbnail'), product.image.url)
+
+    def test_unreadable_image_keeps_previous_renditions(self):
+        product = Product(image=SimpleUploadedFile('broken.jpg', b'not an image'))
+        product.image.save('broken.jpg', product.image.file, save=False)
+        with self.assertLogs('foodcartapp.renditions', 'ERROR'):
+            self.assertIsNone(refresh_renditions(product, PRODUCT_RENDITIONS))
+
+
+class CatalogSnapshotTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        use_temporary_media(self)
+        self.restaurant = Restaurant.objects.create(name='Ресторан', address='Москва')
+        self.product = create_available_product(self.restaurant, name='Бургер')
+
+    def test_snapshot_is_served_with_etag_and_version(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.json()], ['Бургер'])
+        self.assertTrue(response['ETag'])
+        self.assertEqual(int(response['X-Catalog-Version']), CatalogVersion.objects.get().value)
+
+        not_modified = self.client.get('/api/products/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified.content, b'')
+
+    def test_product_edit_publishes_new_snapshot(self):
+        first = self.client.get('/api/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 150
+            self.product.save()
+
+        response = self.client.get('/api/products/', headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertGreater(int(response['X-Catalog-Version']), int(first['X-Catalog-Version']))
+        self.assertEqual(response.json()[0]['price'], '150.00')
+
+    # Запросы ограничителя к таблице корзин не относятся к каталогу
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_snapshot_is_built_once_per_version(self):
+        self.client.get('/api/products/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/products/').status_code, 200)
+
+
+class CatalogPagesTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        use_temporary_media(self)
+        self.restaurant = Restaurant.objects.create(name='Ресторан', address='Москва')
+        self.products = [
+            create_available_product(self.restaurant, name=f'Бургер {number}')
+            for number in range(5)
+        ]
+
+    def get_all_pages(self, url, between_pages=None):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names.extend(product['name'] for product in response.json())
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+            if between_pages:
+                between_pages()
+                between_pages = None
+        return names
+
+    def test_link_header_points_to_next_page(self):
+        response = self.client.get('/api/products/', {'limit': 2, 'fields': 'id,name'})
+        self.assertEqual([product['id'] for product in response.json()], [product.id for product in self.products[:2]])
+        self.assertEqual(
+            response['Link'],
+            f'</api/products/?limit=2&fields=id%2Cname&cursor={self.products[1].id}>; rel="next"',
+        )
+        self.assertEqual(set(response.json()[0]), {'id', 'name'})
+
+    def test_pages_stay_stable_when_products_are_added(self):
+        def add_product():
+            create_available_product(self.restaurant, name='Новый бургер')
+
+        names = self.get_all_pages('/api/products/?limit=2', between_pages=add_product)
+        # Ни одного повтора или пропуска, новый товар попадает в конец
+        self.assertEqual(names, [product.name for product in self.products] + ['Новый бургер'])
+
+    def test_full_last_page_links_to_an_empty_page(self):
+        response = self.client.get('/api/products/', {'limit': 5})
+        self.assertIn('Link', response)
+        response = self.client.get(response['Link'][1:response['Link'].index('>')])
+        self.assertEqual(response.json(), [])
+        self.assertNotIn('Link', response)
+
+    def test_invalid_page_parameters(self):
+        for params in [{'limit': 0}, {'cursor': -1}, {'limit': 'много'}]:
+            self.assertEqual(self.client.get('/api/products/', params).status_code, 400)
+
+    @override_settings(CATALOG_STREAMING=True, CATALOG_CHUNK_SIZE=2)
+    def test_streaming_catalog_is_valid_json_in_chunks(self):
+        response = self.client.get('/api/products/')
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        # '[', три куска по два товара максимум и ']'
+        self.assertEqual(len(chunks), 5)
+        products = json.loads(b''.join(chunks))
+        self.assertEqual([product['name'] for product in products], [product.name for product in self.products])
+
+    def test_iter_catalog_json_of_empty_catalog(self):
+        self.assertEqual(b''.join(iter_catalog_json(Product.objects.none())), b'[]')
+
+
+class CatalogChangesTest(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_delta_after_pruning_requires_resync(self):
+        old_product = Product.objects.create(name='Старый бургер', price=100)
+        CatalogChange.objects.update(changed_at=timezone.now() - timedelta(days=30))
+        new_product = Product.objects.create(name='Новый бургер', price=200)
+
+        deleted = prune_catalog_changes(timezone.now() - timedelta(days=7))
+        self.assertEqual(deleted, 1)
+        self.assertFalse(CatalogChange.objects.filter(product_id=old_product.id).exists())
+
+        response = self.client.get('/api/products/changes/', {'since': 0})
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.json()['resync'])
+
+        response = self.client.get('/api/products/changes/', {'since': 1})
+        self.assertEqual(response.status_code, 200)
+        # Товар не продаётся ни в одном ресторане, поэтому попадает в removed
+        self.assertEqual(response.json()['removed'], [new_product.id])
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if not cursor.fetchone():
+                self.skipTest('расширение pg_trgm не установлено')
+        self.burger = Product.objects.create(name='Чизбургер', price=100)
+        self.combo = Product.objects.create(
+            name='Комбо', price=300, description='Двойной чизбургер с беконом и картошка')
+        Product.objects.create(name='Молочный коктейль', price=150, description='Ванильный')
+
+    def test_name_match_ranks_above_description_match(self):
+        found = list(Product.objects.search('чизбургер'))
+        self.assertEqual(found, [self.burger, self.combo])
+        self.assertGreater(found[0].search_rank, found[1].search_rank)
+
+    def test_typos_are_matched_by_trigrams(self):
+        self.assertEqual(list(Product.objects.search('чизбургр')), [self.burger, self.combo])
+        self.assertEqual(list(Product.objects.search('картошко')), [self.combo])
+
+    def test_admin_changelist_orders_by_rank_or_chosen_column(self):
+        # Товар с совпадением в описании создан раньше, без учёта
+        # релевантности он оказался бы выше
+        first = Product.objects.create(
+            name='Сет', price=500, description='Острый наггетс и соус')
+        best = Product.objects.create(name='Наггетсы', price=120)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        response = self.client.get('/admin/foodcartapp/product/', {'q': 'наггетсы'})
+        self.assertEqual(list(response.context['cl'].result_list), [best, first])
+
+        response = self.client.get('/admin/foodcartapp/product/', {'q': 'наггетсы', 'o': '-4'})
+        self.assertEqual(list(response.context['cl'].result_list), [first, best])
+
+
+class ProductAvailabilityTest(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_product_save_keeps_counter_written_by_menu(self):
+        product = Product.objects.create(name='Бургер', price=100)
+        restaurant = Restaurant.objects.create(name='Ресторан', address='Москва')
+        stale_product = Product.objects.get(pk=product.pk)
+
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=product)
+        stale_product.price = 150
+        stale_product.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.price, 150)
+        self.assertEqual(product.available_restaurants_count, 1)
+        self.assertTrue(Product.objects.available().filter(pk=product.pk).exists())
+
+    def test_save_of_partially_loaded_product_keeps_deferred_fields(self):
+        product = Product.objects.create(name='Бургер', price=100, description='Сочный')
+        partial_product = Product.objects.only('id', 'name').get(pk=product.pk)
+        partial_product.name = 'Чизбургер'
+        partial_product.save()
+
+        self.assertLessEqual({'price', 'description'}, partial_product.get_deferred_fields())
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.description), ('Чизбургер', 'Сочный'))
+
+
+class ConcurrentAvailabilityTest(TransactionTestCase):
+    # Нужны две настоящие транзакции в разных соединениях
+    serialized_rollback = True
+
+    def test_menu_changes_in_parallel_transactions_keep_counter(self):
+        product = Product.objects.create(name='Бургер', price=100)
+        first_restaurant = Restaurant.objects.create(name='Первый', address='Москва')
+        second_restaurant = Restaurant.objects.create(name='Второй', address='Москва')
+        first_item = RestaurantMenuItem.objects.create(restaurant=first_restaurant, product=product)
+        second_item = RestaurantMenuItem.objects.create(
+            restaurant=second_restaurant, product=product, availability=False,
+        )
+        both_changed = threading.Barrier(2, timeout=10)
+        errors = []
+
+        def change_menu(item, availability):
+            try:
+                with transaction.atomic():
+                    # Пункт меню меняется в обход сигналов, пересчёт идёт,
+                    # когда обе транзакции уже изменили свои пункты
+                    RestaurantMenuItem._base_manager.filter(pk=item.pk).update(availability=availability)
+                    both_changed.wait()
+                    sync_menu_changes([product.pk])
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=change_menu, args=(first_item, False)),
+            threading.Thread(target=change_menu, args=(second_item, True)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        self.assertEqual(product.available_restaurants_count, 1)
+        self.assertTrue(Product.objects.available().filter(pk=product.pk).exists())
+
+
+class RestaurantMenuApiTest(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_unknown_restaurant_is_json_404(self):
+        response = self.client.get('/api/restaurants/999/menu/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'error': 'Ресторан не найден'})
+
+
+class BannersTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        use_temporary_media(self)
+
+    @override_settings(BANNERS_CACHE_TIMEOUT=300)
+    def test_cache_timeout_is_bounded(self):
+        Banner.objects.create(title='Бургер', image=build_image())
+        with mock.patch('foodcartapp.banners.cache') as banners_cache:
+            banners_cache.get.return_value = None
+            get_banners_content()
+        self.assertEqual(banners_cache.set.call_args.kwargs['timeout'], 300)
+
+        Banner.objects.create(title='Скоро', image=build_image(), starts_at=timezone.now() + timedelta(seconds=60))
+        with mock.patch('foodcartapp.banners.cache') as banners_cache:
+            banners_cache.get.return_value = None
+            get_banners_content()
+        self.assertLessEqual(banners_cache.set.call_args.kwargs['timeout'], 60)
+
+    def test_banner_migration_does_not_copy_assets_twice(self):
+        migration = importlib.import_module('foodcartapp.migrations.0050_move_banners_to_db')
+        for _ in range(2):
+            Banner.objects.all().delete()
+            migration.create_banners(apps, None)
+
+        self.assertEqual(Banner.objects.count(), len(migration.BANNERS))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, 'banners'))),
+            sorted(filename for _, filename, _ in migration.BANNERS),
+        )
+
+
+def build_order_payload(*products):
+    return {
+        'firstname': 'Иван',
+        'lastname': 'Петров',
+        'phonenumber': '+79001234567',
+        'address': 'Москва, ул. Ленина, 5',
+        'products': [{'product': product_id, 'quantity': 1} for product_id in products],
+    }
+
+
+@override_settings(ORDER_INGESTION_ASYNC=True)
+class OrderIngestionTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.product = Product.objects.create(name='Бургер', price=100)
+
+    def test_reference_resolves_to_created_order(self):
+        response = self.client.post('/api/order/', build_order_payload(self.product.id), content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        status_url = f"/api/order/ingestions/{response.json()['reference']}/"
+
+        self.assertEqual(self.client.get(status_url).json()['status'], OrderIngestion.PENDING)
+        self.assertEqual(process_ingestion_batch(10), 1)
+
+        ingestion_status = self.client.get(status_url).json()
+        self.assertEqual(ingestion_status['status'], OrderIngestion.DONE)
+        self.assertEqual(ingestion_status['order'], Order.objects.get().id)
+
+    def test_invalid_order_is_rejected_before_enqueueing(self):
+        response = self.client.post('/api/order/', build_order_payload(999), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrderIngestion.objects.exists())
+
+    def test_unknown_reference(self):
+        response = self.client.get('/api/order/ingestions/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, 404)
+
+
+class IngestionBatchTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.product = Product.objects.create(name='Бургер', price=100)
+
+    def enqueue(self, **changes):
+        return OrderIngestion.objects.create(payload={**build_order_payload(self.product.id), **changes})
+
+    def test_database_error_fails_only_the_poison_order(self):
+        # Ошибку базы на уровне одной строки имитирует ограничение CHECK
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "ALTER TABLE foodcartapp_order ADD CONSTRAINT test_poison CHECK (firstname <> 'Яд')"
+            )
+        good = self.enqueue()
+        poison = self.enqueue(firstname='Яд')
+        invalid = self.enqueue(products=[])
+
+        self.assertEqual(process_ingestion_batch(10), 3)
+
+        good.refresh_from_db()
+        poison.refresh_from_db()
+        invalid.refresh_from_db()
+        self.assertEqual(good.status, OrderIngestion.DONE)
+        self.assertEqual(good.order.firstname, 'Иван')
+        self.assertEqual(poison.status, OrderIngestion.FAILED)
+        self.assertIn('test_poison', poison.error)
+        self.assertEqual(invalid.status, OrderIngestion.FAILED)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(process_ingestion_batch(10), 0)
+
+    def test_batch_of_invalid_orders_does_not_raise(self):
+        first = self.enqueue(products=[])
+        second = self.enqueue(phonenumber='не телефон')
+
+        self.assertEqual(process_ingestion_batch(10), 2)
+        self.assertEqual(
+            set(OrderIngestion.objects.values_list('status', flat=True)),
+            {OrderIngestion.FAILED},
+        )
+        self.assertFalse(Order.objects.exists())
+        self.assertNotEqual(first.reference, second.reference)
+
+    @override_settings(ORDER_BATCH_MAX_SIZE=2)
+    def test_batch_size_is_capped(self):
+        for _ in range(3):
+            self.enqueue()
+
+        self.assertEqual(process_ingestion_batch(10), 2)
+        self.assertEqual(process_ingestion_batch(10), 1)
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_rejected_batch_falls_back_to_single_orders(self):
+        def reject_batches(serializer, orders):
+            if len(orders) > 1:
+                raise ValidationError('Пакет отвергнут')
+            return orders
+
+        good = self.enqueue()
+        invalid = self.enqueue(products=[])
+        with mock.patch.object(OrderListSerializer, 'validate', autospec=True, side_effect=reject_batches):
+            self.assertEqual(process_ingestion_batch(10), 2)
+
+        good.refresh_from_db()
+        invalid.refresh_from_db()
+        self.assertEqual(good.status, OrderIngestion.DONE)
+        self.assertEqual(good.order, Order.objects.get())
+        self.assertEqual(invalid.status, OrderIngestion.FAILED)
+        self.assertIn('products', invalid.error)
+
+
+class OrdersBatchApiTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.product = Product.objects.create(name='Бургер', price=100)
+
+    def test_partial_failure_returns_207_with_item_errors(self):
+        response = self.client.post(
+            '/api/orders/batch/',
+            [build_order_payload(self.product.id), build_order_payload(999)],
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 207)
+        first, second = response.json()
+        self.assertEqual(first['id'], Order.objects.get().id)
+        self.assertEqual(second['index'], 1)
+        self.assertIn('products', second['errors'])
+
+    def test_all_valid_returns_201(self):
+        response = self.client.post(
+            '/api/orders/batch/',
+            [build_order_payload(self.product.id)] * 2,
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class IdempotentOrderTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.product = Product.objects.create(name='Бургер', price=100)
+
+    def post_order(self, payload, key):
+        return self.client.post(
+            '/api/order/',
+            payload,
+            content_type='application/json',
+            headers={'Idempotency-Key': key},
+        )
+
+    def test_retry_replays_saved_response(self):
+        payload = build_order_payload(self.product.id)
+        first = self.post_order(payload, 'order-1')
+        retry = self.post_order(payload, 'order-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_other_body_is_422(self):
+        self.post_order(build_order_payload(self.product.id), 'order-1')
+        response = self.post_order({**build_order_payload(self.product.id), 'firstname': 'Пётр'}, 'order-1')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_rejected_request_does_not_take_the_key(self):
+        self.assertEqual(self.post_order(build_order_payload(999), 'order-1').status_code, 400)
+        self.assertEqual(self.post_order(build_order_payload(self.product.id), 'order-1').status_code, 201)
+
+
+class OrderProductsTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.products = [Product.objects.create(name=f'Бургер {number}', price=100) for number in range(3)]
+
+    def test_products_of_batch_are_loaded_in_one_query(self):
+        serializer = OrderSerializer(
+            data=[build_order_payload(*[product.id for product in self.products])] * 5,
+            many=True,
+        )
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+    def test_product_id_must_be_integer(self):
+        product_id = self.products[1].id
+        for value in [product_id + 0.9, str(product_id + 0.9), True, [product_id]]:
+            payload = build_order_payload()
+            payload['products'] = [{'product': value, 'quantity': 1}]
+            serializer = OrderSerializer(data=payload)
+            self.assertFalse(serializer.is_valid(), value)
+            self.assertEqual(serializer.errors['products'][0]['product'][0].code, 'incorrect_type')
+
+        payload = build_order_payload()
+        payload['products'] = [{'product': str(product_id), 'quantity': 1}]
+        serializer = OrderSerializer(data=payload)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+
+class OrderTotalPriceTest(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def post_order(self, product, quantity):
+        payload = build_order_payload()
+        payload['products'] = [{'product': product.id, 'quantity': quantity}]
+        return self.client.post('/api/order/', payload, content_type='application/json')
+
+    def test_total_is_stored_with_order(self):
+        product = Product.objects.create(name='Бургер', price='99.50')
+        self.assertEqual(self.post_order(product, 3).status_code, 201)
+        self.assertEqual(Order.objects.get().total_price, Decimal('298.50'))
+
+    def test_total_overflow_is_validation_error(self):
+        product = Product.objects.create(name='Золотой бургер', price='999999.99')
+        response = self.post_order(product, 1000)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('products', response.json())
+        self.assertFalse(Order.objects.exists())
+
+    def test_large_quantity_is_limited_only_by_total(self):
+        product = Product.objects.create(name='Соус', price='10.00')
+        self.assertEqual(self.post_order(product, 5000).status_code, 201)
+        self.assertEqual(Order.objects.get().total_price, Decimal('50000.00'))
+        self.assertEqual(self.post_order(product, 2 ** 31).status_code, 400)
+
+
+class RateLimitBucketTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.now = 1000.5
+        clock = mock.patch('foodcartapp.ratelimit.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_bucket_allows_capacity_requests(self):
+        bucket = Bucket(rate=1, capacity=3)
+        self.assertEqual([bucket.take('client') for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.take('client'), 1)
+        self.assertEqual(bucket.take('other-client'), 0)
+        self.assertEqual(RateLimitBucket.objects.count(), 2)
+
+    def test_tokens_refill_at_rate_up_to_capacity(self):
+        bucket = Bucket(rate=2, capacity=3)
+        for _ in range(3):
+            bucket.take('client')
+        # Через полсекунды накопился ровно один жетон, а не новое окно
+        self.now += 0.5
+        self.assertEqual(bucket.take('client'), 0)
+        self.assertEqual(bucket.take('client'), 1)
+
+        self.now += 3600
+        self.assertEqual([bucket.take('client') for _ in range(4)], [0, 0, 0, 1])
+
+    def test_reserve_is_left_for_other_lanes(self):
+        bucket = Bucket(rate=1, capacity=10)
+        for _ in range(8):
+            self.assertEqual(bucket.take('total', reserve=2), 0)
+        # Отклонённые запросы каталога не расходуют резерв оформления заказов
+        for _ in range(5):
+            self.assertEqual(bucket.take('total', reserve=2), 1)
+        self.assertEqual(bucket.take('total'), 0)
+        self.assertEqual(bucket.take('total'), 0)
+        self.assertEqual(bucket.take('total'), 1)
+
+    def test_given_back_request_can_be_repeated(self):
+        bucket = Bucket(rate=1, capacity=1)
+        self.assertEqual(bucket.take('client'), 0)
+        bucket.give_back('client')
+        self.assertEqual(bucket.take('client'), 0)
+        self.assertEqual(bucket.take('client'), 1)
+
+    @override_settings(RATE_LIMITS={'checkout': (1, 10)}, RATE_LIMIT_TOTAL=(10, 100))
+    def test_prune_deletes_only_refilled_buckets(self):
+        Bucket(rate=1, capacity=10).take('idle')
+        self.now += 11
+        Bucket(rate=1, capacity=10).take('busy')
+
+        self.assertEqual(prune_buckets(), 1)
+        self.assertEqual(list(RateLimitBucket.objects.values_list('key', flat=True)), ['busy'])
+
+
+@override_settings(
+    RATE_LIMIT_ENABLED=True,
+    RATE_LIMITS={'checkout': (0.01, 1), 'catalog': (5, 30), 'status': (2, 20)},
+)
+class RateLimitMiddlewareTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.product = Product.objects.create(name='Бургер', price=100)
+
+    def test_status_polling_does_not_spend_checkout_tokens(self):
+        self.assertEqual(get_lane('/api/order/ingestions/1/'), (STATUS, '/api/order/ingestions/'))
+        for _ in range(3):
+            response = self.client.get(f'/api/order/ingestions/{uuid.uuid4()}/')
+            self.assertEqual(response.status_code, 404)
+
+        payload = build_order_payload(self.product.id)
+        self.assertEqual(self.client.post('/api/order/', payload, content_type='application/json').status_code, 201)
+        response = self.client.post('/api/order/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+
+
+def shift(lat, lon, north_km=0, east_km=0):
+    # Точка в заданном числе километров к северу и востоку
+    lat_step = 1 / 111.195
+    lon_step = lat_step / math.cos(math.radians(lat))
+    return lat + north_km * lat_step, lon + east_km * lon_step
+
+
+CENTER = (55.75, 37.62)
+
+
+class GeocodeWarmCommandTest(TestCase):
+    def test_rate_and_batch_size_must_be_positive(self):
+        for option, value in [('--rate', '0'), ('--rate', '-1'), ('--rate', 'nan'), ('--batch-size', '0')]:
+            with self.assertRaisesMessage(CommandError, 'больше нуля'):
+                call_command('geocode_warm', option, value)
+
+    def test_addresses_are_fetched_through_one_throttle(self):
+        Restaurant.objects.create(name='Ресторан', address='Москва, ул. Ленина, 5')
+        Restaurant.objects.create(name='Ещё ресторан', address='Москва, ул. Мира, 1')
+        with mock.patch(
+            'foodcartapp.management.commands.geocode_warm.geocode_addresses', return_value={},
+        ) as geocode:
+            call_command('geocode_warm', '--batch-size', '1', '--rate', '5', stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(geocode.call_count, 2)
+        throttles = {call.kwargs['throttle'] for call in geocode.call_args_list}
+        self.assertEqual(len(throttles), 1)
+        self.assertEqual(throttles.pop().interval, 0.2)
+
+
+class RestaurantIndexTest(TestCase):
+    def build_index(self, points, cell_km=1):
+        return RestaurantIndex(
+            {restaurant_id: point for restaurant_id, point in enumerate(points, start=1)},
+            {restaurant_id: f'Ресторан {restaurant_id}' for restaurant_id in range(1, len(points) + 1)},
+            cell_km,
+        )
+
+    def brute_force(self, index, lat, lon):
+        distances = distance_matrix([(lat, lon)], index.points)[0]
+        return sorted(zip(index.ids, distances.tolist()), key=lambda item: item[1])
+
+    def test_neighbour_cell_beats_far_corner_of_own_cell(self):
+        # Точка заказа у края ячейки: ресторан за границей ближе, чем
+        # ресторан в дальнем углу той же ячейки
+        index = self.build_index([
+            shift(*CENTER, 0.05, 0.05),
+            shift(*CENTER, 0.95, 0.95),
+            shift(*CENTER, 0.5, -0.05),
+        ])
+        lat, lon = shift(*CENTER, 0.5, 0.02)
+        nearest_id, _ = index.nearest(lat, lon, k=1)[0]
+        self.assertEqual(nearest_id, self.brute_force(index, lat, lon)[0][0])
+
+    def test_nearest_matches_brute_force_around_ring_boundaries(self):
+        random = Random(25)
+        points = [shift(*CENTER, random.uniform(-10, 10), random.uniform(-10, 10)) for _ in range(200)]
+        index = self.build_index(points, cell_km=2)
+        for _ in range(100):
+            # Точки заказов ставятся вплотную к границам ячеек
+            north_km = random.randint(-6, 6) * 2 + random.choice([-0.001, 0.001])
+            east_km = random.uniform(-12, 12)
+            lat, lon = shift(*CENTER, north_km, east_km)
+            expected = self.brute_force(index, lat, lon)
+            for k in (1, 5, 20):
+                self.assertEqual(
+                    [restaurant_id for restaurant_id, _ in index.nearest(lat, lon, k=k)],
+                    [restaurant_id for restaurant_id, _ in expected[:k]],
+                )
+            within_radius = [restaurant_id for restaurant_id, distance in expected if distance <= 3]
+            self.assertEqual([restaurant_id for restaurant_id, _ in index.nearest(lat, lon, radius_km=3)], within_radius)
+            candidates = {index.ids[row] for row in index.candidate_rows(lat, lon, radius_km=3)}
+            self.assertLessEqual(set(within_radius), candidates)
+
+    def test_radius_edge(self):
+        index = self.build_index([shift(*CENTER, 2.99), shift(*CENTER, 3.01), shift(*CENTER, -2.99)], cell_km=1)
+        self.assertEqual({restaurant_id for restaurant_id, _ in index.nearest(*CENTER, radius_km=3)}, {1, 3})
+
+
+def create_place(address, lat, lon):
+    return Place.objects.create(address=address, latitude=round(lat, 6), longitude=round(lon, 6), geocode_status=Place.OK)
+
+
+@override_settings(DELIVERY_RADIUS_KM=5, NEAREST_RESTAURANTS_LIMIT=2)
+class OrderDistancesTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.burger = Product.objects.create(name='Бургер', price=100)
+        self.fries = Product.objects.create(name='Картошка', price=50)
+        offsets = {'Рядом': 1, 'Недалеко': 2, 'Дальше': 3, 'За радиусом': 8}
+        self.restaurants = {}
+        coordinates = {}
+        for name, north_km in offsets.items():
+            restaurant = Restaurant.objects.create(name=name, address=f'Москва, {name}')
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.burger)
+            self.restaurants[name] = restaurant
+            coordinates[restaurant.id] = shift(*CENTER, north_km)
+        RestaurantMenuItem.objects.create(restaurant=self.restaurants['Дальше'], product=self.fries)
+        self.index = RestaurantIndex(
+            coordinates,
+            {restaurant.id: restaurant.name for restaurant in self.restaurants.values()},
+            cell_km=1,
+        )
+        create_place('Москва, Кремль', *CENTER)
+
+    def create_order(self, *products, **fields):
+        order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79001234567',
+            address='Москва, Кремль',
+            **fields,
+        )
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        return order
+
+    def test_orders_share_one_menu_query(self):
+        self.create_order(self.burger)
+        self.create_order(self.burger, self.fries)
+        self.create_order()
+        orders = list(Order.objects.prefetch_related('items').order_by('id'))
+        place_map = {place.address_key: place for place in Place.objects.all()}
+
+        with self.assertNumQueries(1):
+            data = process_orders(orders, self.index, place_map, None)
+
+        self.assertEqual(
+            [[restaurant['name'] for restaurant in distances] for _, distances in data],
+            [['Рядом', 'Недалеко'], ['Дальше'], ['Рядом', 'Недалеко']],
+        )
+        self.assertAlmostEqual(data[0][1][0]['distance'], 1, places=1)
+
+    def test_admin_keeps_assigned_and_capable_restaurants(self):
+        order = self.create_order(self.burger, restaurant=self.restaurants['За радиусом'])
+        RestaurantMenuItem.objects.filter(restaurant=self.restaurants['За радиусом']).update(availability=False)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        with mock.patch('foodcartapp.admin.get_restaurant_index', return_value=self.index), \
+                mock.patch('places.services.get_geocoder') as get_geocoder:
+            response = self.client.get(f'/admin/foodcartapp/order/{order.id}/change/')
+
+        get_geocoder.assert_not_called()
+        queryset = response.context['adminform'].form.fields['restaurant'].queryset
+        # Лимит ближайших не прячет подходящие рестораны внутри радиуса
+        self.assertEqual(
+            [restaurant.name for restaurant in queryset],
+            ['Рядом', 'Недалеко', 'Дальше', 'За радиусом'],
+        )
+
+
+class RestaurantIndexBuildTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        patcher = mock.patch.multiple(
+            'foodcartapp.spatial', _index=None, _index_tokens=None, _index_built_at=0, _index_building=False,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('foodcartapp.spatial.register_order_addresses')
+        self.register = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unknown_addresses_are_geocoded_in_background(self):
+        create_place('Москва, Кремль', *CENTER)
+        known = Restaurant.objects.create(name='Известный', address='Москва, Кремль')
+        unknown = Restaurant.objects.create(name='Новый', address='Москва, ул. Новая, 1')
+
+        with mock.patch('places.services.get_geocoder') as get_geocoder:
+            index = get_restaurant_index()
+
+        get_geocoder.assert_not_called()
+        self.register.assert_called_once_with([unknown.address])
+        self.assertIn(known.id, index)
+        self.assertNotIn(unknown.id, index)
+
+    def test_stale_index_is_served_while_rebuilding(self):
+        old_index = get_restaurant_index()
+        new_index = RestaurantIndex({}, {}, 1)
+        build_started = threading.Event()
+        build_released = threading.Event()
+
+        def slow_build():
+            build_started.set()
+            build_released.wait(5)
+            return new_index
+
+        caches[settings.VERSION_CACHE].set(INDEX_VERSION_KEY, 'изменён', None)
+        results = []
+        with mock.patch('foodcartapp.spatial.build_restaurant_index', side_effect=slow_build):
+            builder = threading.Thread(target=lambda: results.append(get_restaurant_index()))
+            builder.start()
+            self.assertTrue(build_started.wait(5))
+            # Второй запрос не ждёт сборки и получает прежний индекс
+            self.assertIs(get_restaurant_index(), old_index)
+            build_released.set()
+            builder.join(5)
+
+        self.assertEqual(results, [new_index])
+        self.assertIs(get_restaurant_index(), new_index)
@@ -1,12 +1,26 @@
 from django.urls import include, path
 
-from .views import (product_list_api, banners_list_api, register_order)
+from .views import (
+    banners_list_api,
+    order_ingestion_status,
+    product_changes_api,
+    product_list_api,
+    product_search_api,
+    register_order,
+    register_orders_batch,
+    restaurant_menu_api,
+)
 
 app_name = "foodcartapp"
 
 urlpatterns = [
     path('products/', product_list_api),
+    path('products/changes/', product_changes_api),
+    path('products/search/', product_search_api),
+    path('restaurants/<int:restaurant_id>/menu/', restaurant_menu_api),
     path('banners/', banners_list_api),
     path('order/', register_order),
+    path('order/ingestions/<uuid:reference>/', order_ingestion_status),
+    path('orders/batch/', register_orders_batch),
     path('api-auth/', include('rest_framework.urls')),
 ]
@@ -1,15 +1,37 @@
+import json
 import logging
 
+from django.conf import settings
 from django.db import transaction
-from django.http import JsonResponse
-from django.templatetags.static import static
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.http import parse_etags
 
 from rest_framework import serializers, status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.serializers import ModelSerializer
 
-from .models import Order, OrderItem, Product
+from .banners import get_banners_content
+from .catalog import (
+    CatalogResyncRequired,
+    get_catalog_delta,
+    get_catalog_page,
+    get_catalog_products,
+    get_catalog_snapshot,
+    get_restaurant_menu_product_ids,
+    iter_catalog_json,
+    parse_fields,
+    parse_page,
+    serialize_product,
+)
+from .idempotency import idempotent
+from .ingestion import enqueue_order
+from .models import Order, OrderIngestion, OrderItem
 from .serializers import OrderSerializer
 
 logger = logging.getLogger(__name__)
@@ -22,61 +44,179 @@ class OrderItemSerializer(ModelSerializer):
 
 
 def banners_list_api(request):
-    # FIXME move data to db?
-    return JsonResponse([
-        {
-            'title': 'Burger',
-            'src': static('burger.jpg'),
-            'text': 'Tasty Burger at your door step',
-        },
-        {
-            'title': 'Spices',
-            'src': static('food.jpg'),
-            'text': 'All Cuisines',
-        },
-        {
-            'title': 'New York',
-            'src': static('tasty.jpg'),
-            'text': 'Food is incomplete without a tasty dessert',
-        }
-    ], safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    return HttpResponse(get_banners_content(), content_type='application/json')
 
 
 def product_list_api(request):
-    products = Product.objects.select_related('category').available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'special_status': product.special_status,
-            'description': product.description,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-            } if product.category else None,
-            'image': product.image.url,
-            'restaurant': {
-                'id': product.id,
-                'name': product.name,
-            }
-        }
-        dumped_products.append(dumped_product)
-    return JsonResponse(dumped_products, safe=False, json_dumps_params={
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+        cursor, limit = parse_page(request.GET)
+    except ValueError as error:
+        return JsonResponse(
+            {'error': str(error)},
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+    if limit:
+        products, next_cursor = get_catalog_page(fields, cursor, limit)
+        response = HttpResponse(
+            b''.join(iter_catalog_json(products, fields)),
+            content_type='application/json',
+        )
+        if next_cursor:
+            params = request.GET.copy()
+            params['cursor'] = next_cursor
+            response['Link'] = f'<{request.path}?{params.urlencode()}>; rel="next"'
+        return response
+
+    if settings.CATALOG_STREAMING or fields:
+        return StreamingHttpResponse(
+            iter_catalog_json(get_catalog_products(fields), fields),
+            content_type='application/json',
+        )
+
+    version, etag, content = get_catalog_snapshot()
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    response['X-Catalog-Version'] = version
+    return response
+
+
+def product_changes_api(request):
+    try:
+        since = int(request.GET['since'])
+    except (KeyError, ValueError):
+        return JsonResponse(
+            {'error': 'Укажите версию каталога: ?since=<целое число>'},
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+    try:
+        version, changed_products, removed_ids = get_catalog_delta(since)
+    except CatalogResyncRequired as error:
+        version, = error.args
+        return JsonResponse(
+            {
+                'error': 'Журнал изменений за этот период очищен, загрузите каталог целиком',
+                'version': version,
+                'resync': True,
+            },
+            status=status.HTTP_410_GONE,
+            json_dumps_params={'ensure_ascii': False},
+        )
+    return JsonResponse({
+        'version': version,
+        'changed': [serialize_product(product) for product in changed_products],
+        'removed': removed_ids,
+    }, json_dumps_params={
         'ensure_ascii': False,
-        'indent': 4,
     })
 
 
+def product_search_api(request):
+    text = request.GET.get('q', '').strip()
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+        _, limit = parse_page(request.GET)
+    except ValueError as error:
+        return JsonResponse(
+            {'error': str(error)},
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
+        )
+    if not text:
+        return JsonResponse(
+            {'error': 'Укажите строку поиска: ?q=<текст>'},
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+    limit = limit or settings.CATALOG_PAGE_SIZE
+    products = get_catalog_products(fields).search(text)[:limit]
+    return HttpResponse(
+        b''.join(iter_catalog_json(products, fields)),
+        content_type='application/json',
+    )
+
+
+def restaurant_menu_api(request, restaurant_id):
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as error:
+        return JsonResponse(
+            {'error': str(error)},
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+    product_ids = get_restaurant_menu_product_ids(restaurant_id)
+    if product_ids is None:
+        return JsonResponse(
+            {'error': 'Ресторан не найден'},
+            status=status.HTTP_404_NOT_FOUND,
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+    products = get_catalog_products(fields).filter(id__in=product_ids)
+    return HttpResponse(
+        b''.join(iter_catalog_json(products, fields)),
+        content_type='application/json',
+    )
+
+
 @transaction.atomic
 @api_view(['POST'])
+@idempotent
 def register_order(request):
     serializer = OrderSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
+    if settings.ORDER_INGESTION_ASYNC:
+        ingestion = enqueue_order(serializer)
+        return Response(
+            {**serializer.data, 'reference': ingestion.reference},
+            status=status.HTTP_202_ACCEPTED,
+        )
     serializer.save()
     return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+def order_ingestion_status(request, reference):
+    # Клиент, получивший 202, узнаёт по номеру обращения, создан ли заказ
+    ingestion = OrderIngestion.objects.filter(reference=reference).first()
+    if ingestion is None:
+        return Response({'error': 'Обращение не найдено'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'reference': ingestion.reference,
+        'status': ingestion.status,
+        'order': ingestion.order_id,
+        'errors': json.loads(ingestion.error) if ingestion.error else None,
+        'processed_at': ingestion.processed_at,
+    })
+
+
+@transaction.atomic
+@api_view(['POST'])
+@idempotent
+def register_orders_batch(request):
+    serializer = OrderSerializer(data=request.data, many=True)
+    serializer.is_valid(raise_exception=True)
+    orders = iter(serializer.save())
+
+    results = []
+    for index in range(len(request.data)):
+        if index in serializer.item_errors:
+            results.append({'index': index, 'errors': serializer.item_errors[index]})
+        else:
+            results.append({'index': index, 'id': next(orders).id})
+
+    return Response(
+        results,
+        status=status.HTTP_207_MULTI_STATUS if serializer.item_errors else status.HTTP_201_CREATED,
+    )
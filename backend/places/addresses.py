@@ -0,0 +1,41 @@
+import re
+
+ADDRESS_KEY_MAX_LENGTH = 255
+
+PUNCTUATION = re.compile(r'[.,;:!?"\'«»()\[\]№#]+')
+
+# Сокращения типов улиц и частей адреса приводятся к полной форме
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пр-д': 'проезд',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'наб': 'набережная',
+    'ш': 'шоссе',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'корп': 'корпус',
+    'стр': 'строение',
+    'кв': 'квартира',
+    'обл': 'область',
+    'р-н': 'район',
+}
+
+# Слова, которые не меняют смысл адреса: «г. Москва, д. 5» и «Москва 5» — одно место
+OMITTED_WORDS = {'г', 'город', 'д', 'дом'}
+
+
+def normalize_address(address):
+    address = address.lower().replace('ё', 'е')
+    words = PUNCTUATION.sub(' ', address).split()
+    words = [
+        ABBREVIATIONS.get(word, word)
+        for word in words
+        if word not in OMITTED_WORDS
+    ]
+    return ' '.join(words)[:ADDRESS_KEY_MAX_LENGTH]
@@ -4,6 +4,9 @@ from .models import Place
 
 @admin.register(Place)
 class PlaceAdmin(admin.ModelAdmin):
+    list_display = ['address', 'geocode_status', 'failed_attempts', 'retry_after', 'create_date']
+    list_filter = ['geocode_status']
+    search_fields = ['address']
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'places'
     from django.contrib import admin
@@ -0,0 +1,71 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+GENERATION_KEY = 'places:geocode_generation'
+
+
+class GeocodeCache:
+    # Ограниченный LRU-кэш мест с координатами внутри процесса, перед таблицей Place.
+    # Воркеры сбрасывают его, когда в общем кэше меняется поколение
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.places = OrderedDict()
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def sync_generation(self):
+        generation = caches[settings.VERSION_CACHE].get(GENERATION_KEY)
+        with self.lock:
+            if generation != self.generation:
+                self.places.clear()
+                self.generation = generation
+
+    def get_many(self, keys):
+        self.sync_generation()
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.places.get(key)
+                if entry is None:
+                    continue
+                place, expires_at = entry
+                if expires_at <= now:
+                    del self.places[key]
+                    continue
+                self.places.move_to_end(key)
+                found[key] = place
+        return found
+
+    def set_many(self, places):
+        expires_at = time.monotonic() + self.ttl
+        with self.lock:
+            for place in places:
+                self.places[place.address_key] = (place, expires_at)
+                self.places.move_to_end(place.address_key)
+            while len(self.places) > self.max_size:
+                self.places.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.places.clear()
+
+
+geocode_cache = GeocodeCache(
+    max_size=settings.GEOCODE_LOCAL_CACHE_SIZE,
+    ttl=settings.GEOCODE_LOCAL_CACHE_TTL,
+)
+
+
+def invalidate_geocode_cache():
+    # Новое поколение после коммита заставит все воркеры сбросить свои кэши
+    geocode_cache.clear()
+    versions_cache = caches[settings.VERSION_CACHE]
+    transaction.on_commit(lambda: versions_cache.set(GENERATION_KEY, uuid.uuid4().hex, None))
@@ -0,0 +1,39 @@
+import numpy as np
+from django.conf import settings
+from geopy.distance import distance
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_matrix(origins, destinations):
+    # origins и destinations — массивы пар (широта, долгота) в градусах,
+    # результат — матрица расстояний в километрах размером origins × destinations
+    origins = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    lat1 = origins[:, 0, np.newaxis]
+    lon1 = origins[:, 1, np.newaxis]
+    lat2 = destinations[np.newaxis, :, 0]
+    lon2 = destinations[np.newaxis, :, 1]
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def geodesic_matrix(origins, destinations):
+    # Точный, но медленный расчёт по эллипсоиду — для сверки с haversine
+    matrix = np.empty((len(origins), len(destinations)))
+    for i, origin in enumerate(origins):
+        for j, destination in enumerate(destinations):
+            matrix[i, j] = distance(origin, destination).km
+    return matrix
+
+
+def distance_matrix(origins, destinations):
+    if not len(origins) or not len(destinations):
+        return np.empty((len(origins), len(destinations)))
+    if settings.DISTANCE_METHOD == 'geodesic':
+        return geodesic_matrix(origins, destinations)
+    return haversine_matrix(origins, destinations)
@@ -0,0 +1,268 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+
+from .addresses import normalize_address
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeocoderError(requests.RequestException):
+    pass
+
+
+class GeocoderUnavailable(GeocoderError):
+    pass
+
+
+class CircuitBreaker:
+    # После failure_threshold неудач подряд запросы к геокодеру не отправляются
+    # recovery_timeout секунд, затем пропускается один пробный запрос
+    def __init__(self, failure_threshold, recovery_timeout):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            # Полуоткрытое состояние: следующий запрос пробный
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"Геокодер недоступен, запросы приостановлены на {self.recovery_timeout} с")
+                self.opened_at = time.monotonic()
+
+
+class RequestThrottle:
+    # Общий для всех потоков темп запросов: не больше rate запросов в секунду.
+    # Каждый запрос занимает следующий свободный интервал и ждёт его начала
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_request_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            request_at = max(self.next_request_at, now)
+            self.next_request_at = request_at + self.interval
+        if request_at > now:
+            time.sleep(request_at - now)
+
+
+class YandexGeocoder:
+    def __init__(self, apikey, base_url, connect_timeout=3, read_timeout=5,
+                 max_retries=2, backoff=0.5, pool_size=10,
+                 failure_threshold=5, recovery_timeout=30):
+        if not apikey:
+            raise ImproperlyConfigured('Для геокодера yandex нужен YANDEX_GEOCODER_API_KEY')
+        self.apikey = apikey
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, recovery_timeout)
+
+        # Одна сессия на процесс: соединения с геокодером переиспользуются
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, address):
+        params = {
+            'geocode': address,
+            'apikey': self.apikey,
+            'format': 'json',
+        }
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # Полный джиттер, чтобы воркеры не повторяли запросы синхронно
+                time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                continue
+            if response.status_code in RETRY_STATUSES:
+                error = requests.HTTPError(f'{response.status_code} от геокодера', response=response)
+                continue
+            response.raise_for_status()
+            return response.json()
+        raise GeocoderError(f'Геокодер не ответил после {self.max_retries + 1} попыток: {error}')
+
+    def fetch_coordinates(self, address):
+        if not self.breaker.allow():
+            raise GeocoderUnavailable('Геокодер временно отключён после серии ошибок')
+        try:
+            payload = self.request(address)
+        except GeocoderError:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        found_places = payload['response']['GeoObjectCollection']['featureMember']
+        if not found_places:
+            return None
+
+        most_relevant = found_places[0]
+        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+        return lon, lat
+
+
+class OfflineGeocoder:
+    # Детерминированный геокодер без сети: координаты берутся из JSON-файла
+    # вида {"адрес": [долгота, широта]}. Для нагрузочных тестов неизвестным
+    # адресам можно выдавать координаты, вычисленные из хэша адреса
+    SYNTHETIC_CENTER = (37.62, 55.75)
+    SYNTHETIC_SPREAD = 0.3
+
+    def __init__(self, gazetteer_path, synthesize=False, latency=0):
+        if not os.path.exists(gazetteer_path):
+            raise ImproperlyConfigured(f'Не найден справочник адресов GEOCODER_GAZETTEER_PATH: {gazetteer_path}')
+        self.synthesize = synthesize
+        self.latency = latency
+        with open(gazetteer_path, encoding='utf-8') as gazetteer_file:
+            gazetteer = json.load(gazetteer_file)
+        self.locations = {
+            normalize_address(address): (str(lon), str(lat))
+            for address, (lon, lat) in gazetteer.items()
+        }
+
+    def fetch_coordinates(self, address):
+        if self.latency:
+            time.sleep(self.latency)
+        key = normalize_address(address)
+        if key in self.locations:
+            return self.locations[key]
+        if not self.synthesize:
+            return None
+        digest = hashlib.sha256(key.encode()).digest()
+        center_lon, center_lat = self.SYNTHETIC_CENTER
+        lon = center_lon + (digest[0] / 255 - 0.5) * self.SYNTHETIC_SPREAD
+        lat = center_lat + (digest[1] / 255 - 0.5) * self.SYNTHETIC_SPREAD
+        return f'{lon:.6f}', f'{lat:.6f}'
+
+
+class RecordingGeocoder:
+    # В режиме записи ответы настоящего геокодера сохраняются в файл,
+    # в режиме воспроизведения геокодер отвечает только из этого файла
+    def __init__(self, recording_path, backend=None, latency=0):
+        if backend is None and not os.path.exists(recording_path):
+            raise ImproperlyConfigured(f'Не найдена запись ответов GEOCODER_RECORDING_PATH: {recording_path}')
+        self.recording_path = recording_path
+        self.backend = backend
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.recording = self.load()
+
+    def load(self):
+        if not os.path.exists(self.recording_path):
+            return {}
+        with open(self.recording_path, encoding='utf-8') as recording_file:
+            return json.load(recording_file)
+
+    def fetch_coordinates(self, address):
+        key = normalize_address(address)
+        if self.backend is None:
+            if self.latency:
+                time.sleep(self.latency)
+            if key not in self.recording:
+                raise GeocoderError(f'Нет записанного ответа для адреса {address}')
+            location = self.recording[key]
+            return tuple(location) if location else None
+
+        location = self.backend.fetch_coordinates(address)
+        with self.lock:
+            self.save(key, list(location) if location else None)
+        return location
+
+    def save(self, key, location):
+        # Файл пишут все воркеры: под файловой блокировкой запись перечитывается,
+        # дополняется и атомарно подменяется через собственный временный файл
+        directory = os.path.dirname(os.path.abspath(self.recording_path))
+        with open(f'{self.recording_path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            recording = self.load()
+            recording[key] = location
+            recording_file = tempfile.NamedTemporaryFile(
+                'w', encoding='utf-8', dir=directory, suffix='.tmp', delete=False,
+            )
+            try:
+                with recording_file:
+                    json.dump(recording, recording_file, ensure_ascii=False, indent=2, sort_keys=True)
+                os.replace(recording_file.name, self.recording_path)
+            except Exception:
+                os.unlink(recording_file.name)
+                raise
+        self.recording = recording
+
+
+def create_yandex_geocoder():
+    return YandexGeocoder(
+        apikey=settings.YANDEX_GEOCODER_API_KEY,
+        base_url=settings.GEOCODER_BASE_URL,
+        connect_timeout=settings.GEOCODER_CONNECT_TIMEOUT,
+        read_timeout=settings.GEOCODER_READ_TIMEOUT,
+        max_retries=settings.GEOCODER_MAX_RETRIES,
+        failure_threshold=settings.GEOCODER_FAILURE_THRESHOLD,
+        recovery_timeout=settings.GEOCODER_RECOVERY_TIMEOUT,
+    )
+
+
+def create_geocoder(backend):
+    if backend == 'yandex':
+        return create_yandex_geocoder()
+    if backend == 'offline':
+        return OfflineGeocoder(
+            settings.GEOCODER_GAZETTEER_PATH,
+            synthesize=settings.GEOCODER_OFFLINE_SYNTHESIZE,
+            latency=settings.GEOCODER_LATENCY,
+        )
+    if backend == 'record':
+        return RecordingGeocoder(settings.GEOCODER_RECORDING_PATH, backend=create_yandex_geocoder())
+    if backend == 'replay':
+        return RecordingGeocoder(settings.GEOCODER_RECORDING_PATH, latency=settings.GEOCODER_LATENCY)
+    raise ImproperlyConfigured(f'Неизвестный GEOCODER_BACKEND: {backend}')
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                _geocoder = create_geocoder(settings.GEOCODER_BACKEND)
+    return _geocoder
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+from places.addresses import normalize_address
+
+
+def fill_address_keys(apps, schema_editor):
+    Place = apps.get_model('places', 'Place')
+    places_by_key = {}
+    for place in Place.objects.order_by('id'):
+        places_by_key.setdefault(normalize_address(place.address), []).append(place)
+
+    duplicate_ids = []
+    for key, places in places_by_key.items():
+        # Из одинаковых адресов остаётся место с координатами, остальные удаляются
+        places.sort(key=lambda place: place.latitude is None or place.longitude is None)
+        kept, *duplicates = places
+        duplicate_ids.extend(place.id for place in duplicates)
+        kept.address_key = key
+
+    Place.objects.filter(id__in=duplicate_ids).delete()
+    Place.objects.bulk_update(
+        [places[0] for places in places_by_key.values()],
+        ['address_key'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('places', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='address_key',
+            field=models.CharField(editable=False, max_length=255, null=True, verbose_name='Нормализованный адрес'),
+        ),
+        migrations.RunPython(fill_address_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='place',
+            name='address_key',
+            field=models.CharField(editable=False, max_length=255, unique=True, verbose_name='Нормализованный адрес'),
+        ),
+    ]
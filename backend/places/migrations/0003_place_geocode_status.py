@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+def mark_geocoded_places(apps, schema_editor):
+    Place = apps.get_model('places', 'Place')
+    Place.objects.filter(latitude__isnull=False, longitude__isnull=False).update(geocode_status='ok')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('places', '0002_place_address_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='failed_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Неудачных попыток подряд'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='geocode_status',
+            field=models.CharField(choices=[('pending', 'Не геокодирован'), ('ok', 'Найден'), ('not_found', 'Не найден'), ('error', 'Ошибка геокодера')], db_index=True, default='pending', max_length=10, verbose_name='Статус геокодирования'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='retry_after',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Повторить не раньше'),
+        ),
+        migrations.RunPython(mark_geocoded_places, migrations.RunPython.noop),
+    ]
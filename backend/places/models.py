@@ -1,11 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
+from .addresses import ADDRESS_KEY_MAX_LENGTH, normalize_address
+
 
 class Place(models.Model):
+    PENDING = 'pending'
+    OK = 'ok'
+    NOT_FOUND = 'not_found'
+    ERROR = 'error'
+    GEOCODE_STATUS_CHOICES = [
+        (PENDING, 'Не геокодирован'),
+        (OK, 'Найден'),
+        (NOT_FOUND, 'Не найден'),
+        (ERROR, 'Ошибка геокодера'),
+    ]
+
     address = models.CharField(
         verbose_name='Адрес', max_length=200, unique=True, db_index=True
     )
+    address_key = models.CharField(
+        verbose_name='Нормализованный адрес', max_length=ADDRESS_KEY_MAX_LENGTH,
+        unique=True, editable=False
+    )
     longitude = models.DecimalField(
         verbose_name='Долгота', max_digits=9, decimal_places=6, null=True, blank=True
     )
@@ -14,6 +34,16 @@ class Place(models.Model):
     )
     create_date = models.DateTimeField(
         verbose_name='Дата изменения', default=timezone.now)
+    geocode_status = models.CharField(
+        verbose_name='Статус геокодирования', max_length=10,
+        choices=GEOCODE_STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    retry_after = models.DateTimeField(
+        verbose_name='Повторить не раньше', null=True, blank=True, db_index=True
+    )
+    failed_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Неудачных попыток подряд', default=0
+    )
 
     class Meta:
         verbose_name = 'место'
@@ -21,3 +51,41 @@ class Place(models.Model):
 
     def __str__(self):
         return self.address
+
+    def save(self, *args, **kwargs):
+        self.address_key = normalize_address(self.address)
+        super().save(*args, **kwargs)
+
+    @property
+    def has_coordinates(self):
+        return self.latitude is not None and self.longitude is not None
+
+    def needs_geocoding(self, now):
+        if self.retry_after and self.retry_after > now:
+            return False
+        if self.geocode_status == self.OK:
+            # Найденные координаты со временем обновляются
+            return self.create_date <= now - timedelta(seconds=settings.GEOCODE_TTL)
+        return True
+
+    def mark_found(self, longitude, latitude, now):
+        self.longitude = longitude
+        self.latitude = latitude
+        self.geocode_status = self.OK
+        self.retry_after = None
+        self.failed_attempts = 0
+        self.create_date = now
+
+    def mark_failed(self, status, now):
+        # Экспоненциальная задержка: ненайденные адреса откладываются надолго,
+        # ошибки геокодера — ненадолго. Старые координаты при этом сохраняются
+        self.geocode_status = status
+        self.failed_attempts += 1
+        base = settings.GEOCODE_NOT_FOUND_BACKOFF if status == self.NOT_FOUND else settings.GEOCODE_ERROR_BACKOFF
+        delay = min(base * 2 ** (self.failed_attempts - 1), settings.GEOCODE_MAX_BACKOFF)
+        self.retry_after = now + timedelta(seconds=delay)
+
+    @classmethod
+    def for_address(cls, address, **kwargs):
+        # Для bulk_create, который не вызывает save()
+        return cls(address=address, address_key=normalize_address(address), **kwargs)
@@ -0,0 +1,156 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from requests import RequestException
+
+from .addresses import normalize_address
+from .cache import geocode_cache, invalidate_geocode_cache
+from .geocoder import get_geocoder
+from .models import Place
+
+logger = logging.getLogger(__name__)
+
+# Геокодирование новых адресов идёт в фоне, вне запроса оформления заказа
+geocoding_executor = ThreadPoolExecutor(
+    max_workers=settings.GEOCODER_BACKGROUND_WORKERS,
+    thread_name_prefix='geocoder',
+)
+
+
+def register_addresses(addresses):
+    # Один INSERT ... ON CONFLICT DO NOTHING без чтения и блокировок существующих строк
+    addresses_by_key = {normalize_address(address): address for address in addresses}
+    Place.objects.bulk_create(
+        [Place.for_address(address) for _, address in sorted(addresses_by_key.items())],
+        ignore_conflicts=True,
+    )
+
+
+def fetch_location(address, throttle=None):
+    if throttle:
+        throttle.wait()
+    try:
+        location = get_geocoder().fetch_coordinates(address)
+    except RequestException as e:
+        logger.error(f"Ошибка геокодера для адреса {address}: {e}")
+        return Place.ERROR, None
+    if not location:
+        logger.warning(f"Не удалось получить координаты для адреса {address} из API")
+        return Place.NOT_FOUND, None
+    return Place.OK, location
+
+
+def load_known_places(keys):
+    # Сначала локальный кэш воркера, в базу идут только промахи.
+    # Возвращает места и ключи, найденные в локальном кэше
+    known_places = geocode_cache.get_many(keys)
+    cached_keys = set(known_places)
+    missed_keys = [key for key in keys if key not in known_places]
+    if missed_keys:
+        loaded_places = Place.objects.filter(address_key__in=missed_keys)
+        known_places.update((place.address_key, place) for place in loaded_places)
+    return known_places, cached_keys
+
+
+def get_known_places(addresses):
+    # Как geocode_addresses, но без обращений к геокодеру: только то,
+    # что уже лежит в кэше воркера или в таблице Place
+    known_places, _ = load_known_places({normalize_address(address) for address in addresses})
+    return {key: place for key, place in known_places.items() if place.has_coordinates}
+
+
+def geocode_addresses(addresses, throttle=None):
+    # Возвращает {нормализованный адрес: Place} для всех адресов с координатами.
+    # Новые, устаревшие и дождавшиеся повтора адреса геокодируются параллельно,
+    # а результаты записываются одним INSERT ... ON CONFLICT DO UPDATE.
+    # throttle — необязательный RequestThrottle, общий для всех потоков
+    addresses_by_key = {}
+    for address in addresses:
+        addresses_by_key.setdefault(normalize_address(address), address)
+    known_places, cached_keys = load_known_places(addresses_by_key)
+    now = timezone.now()
+    stale_places = []
+    previous_coordinates = {}
+    for key, address in sorted(addresses_by_key.items()):
+        place = known_places.get(key)
+        if place is None:
+            stale_places.append(Place.for_address(address))
+        elif place.needs_geocoding(now):
+            # Копия без pk: upsert идёт по address_key, а не по первичному ключу
+            stale_places.append(Place.for_address(
+                place.address,
+                longitude=place.longitude,
+                latitude=place.latitude,
+                create_date=place.create_date,
+                failed_attempts=place.failed_attempts,
+            ))
+            if place.has_coordinates:
+                previous_coordinates[key] = (place.longitude, place.latitude)
+
+    if stale_places:
+        workers = min(settings.GEOCODER_BATCH_WORKERS, len(stale_places))
+        # В потоках только HTTP-запросы, к базе они не обращаются
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geocoder-batch') as executor:
+            results = list(executor.map(
+                partial(fetch_location, throttle=throttle),
+                [place.address for place in stale_places],
+            ))
+
+        for place, (status, location) in zip(stale_places, results):
+            if status == Place.OK:
+                longitude, latitude = location
+                place.mark_found(Decimal(longitude), Decimal(latitude), now)
+            else:
+                place.mark_failed(status, now)
+            known_places[place.address_key] = place
+
+        Place.objects.bulk_create(
+            stale_places,
+            update_conflicts=True,
+            unique_fields=['address_key'],
+            update_fields=[
+                'longitude', 'latitude', 'create_date',
+                'geocode_status', 'retry_after', 'failed_attempts',
+            ],
+        )
+        # Новые адреса в других воркерах ещё не закэшированы, а неудачное
+        # обновление оставляет старые координаты. Кэши сбрасываются, только
+        # если координаты известного места действительно сдвинулись
+        if any(
+            (place.longitude, place.latitude) != previous_coordinates[place.address_key]
+            for place in stale_places
+            if place.address_key in previous_coordinates
+        ):
+            invalidate_geocode_cache()
+
+    place_map = {key: place for key, place in known_places.items() if place.has_coordinates}
+    geocode_cache.set_many(
+        place for key, place in place_map.items()
+        if key not in cached_keys and not place.needs_geocoding(now)
+    )
+    return place_map
+
+
+def geocode_missing_places(addresses):
+    try:
+        geocode_addresses(addresses)
+    except Exception:
+        logger.exception(f"Ошибка фонового геокодирования адресов {addresses}")
+    finally:
+        # У каждого потока своё соединение с БД, его нужно закрыть самому
+        connection.close()
+
+
+def register_order_addresses(addresses):
+    addresses = list(set(addresses))
+    try:
+        register_addresses(addresses)
+    except DatabaseError as e:
+        logger.error(f"Ошибка при создании мест для адресов {addresses}: {str(e)}")
+        return
+    geocoding_executor.submit(geocode_missing_places, addresses)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_geocode_cache
+from .models import Place
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def reset_geocode_cache(sender, instance, **kwargs):
+    invalidate_geocode_cache()
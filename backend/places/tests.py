@@ -0,0 +1,370 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .addresses import normalize_address
+from .geocoder import (
+    GeocoderError,
+    GeocoderUnavailable,
+    OfflineGeocoder,
+    RecordingGeocoder,
+    RequestThrottle,
+    YandexGeocoder,
+)
+from .models import Place
+from .services import geocode_addresses
+
+
+def build_geocoder_payload(*positions):
+    return {
+        'response': {
+            'GeoObjectCollection': {
+                'featureMember': [
+                    {'GeoObject': {'Point': {'pos': position}}}
+                    for position in positions
+                ],
+            },
+        },
+    }
+
+
+class StubGeocoderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(parse_qs(urlparse(self.path).query))
+        status, payload, delay = server.responses.pop(0) if server.responses else server.default_response
+        if delay:
+            time.sleep(delay)
+        body = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент перестал ждать ответа по таймауту
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class YandexGeocoderTest(SimpleTestCase):
+    # Настоящий HTTP-клиент ходит в локальный сервер-заглушку, время
+    # ожиданий и джиттер подменяются внутри модуля геокодера
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGeocoderHandler)
+        self.server.requests = []
+        self.server.responses = []
+        self.server.default_response = (200, build_geocoder_payload('37.6 55.7'), 0)
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        time_patcher = mock.patch('places.geocoder.time')
+        self.clock = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.clock.monotonic.return_value = 1000.0
+
+        random_patcher = mock.patch('places.geocoder.random')
+        self.random = random_patcher.start()
+        self.addCleanup(random_patcher.stop)
+        self.random.uniform.side_effect = lambda low, high: high
+
+    def create_geocoder(self, **options):
+        host, port = self.server.server_address
+        return YandexGeocoder(
+            apikey='test-key',
+            base_url=f'http://{host}:{port}/1.x',
+            **{'read_timeout': 1, 'max_retries': 2, 'backoff': 0.5, **options},
+        )
+
+    def respond(self, *responses):
+        self.server.responses.extend(
+            response if isinstance(response, tuple) else (response, {}, 0)
+            for response in responses
+        )
+
+    def test_success(self):
+        geocoder = self.create_geocoder()
+        self.assertEqual(geocoder.fetch_coordinates('Москва, ул. Ленина, 5'), ('37.6', '55.7'))
+
+        request, = self.server.requests
+        self.assertEqual(request['geocode'], ['Москва, ул. Ленина, 5'])
+        self.assertEqual(request['apikey'], ['test-key'])
+        self.clock.sleep.assert_not_called()
+
+    def test_unknown_address(self):
+        self.server.default_response = (200, build_geocoder_payload(), 0)
+        self.assertIsNone(self.create_geocoder().fetch_coordinates('Нигде'))
+
+    def test_server_errors_are_retried_with_full_jitter(self):
+        self.respond(503, 500)
+        geocoder = self.create_geocoder()
+
+        self.assertEqual(geocoder.fetch_coordinates('Москва'), ('37.6', '55.7'))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(
+            self.random.uniform.call_args_list,
+            [mock.call(0, 0.5), mock.call(0, 1.0)],
+        )
+        self.assertEqual(self.clock.sleep.call_args_list, [mock.call(0.5), mock.call(1.0)])
+
+    def test_error_after_last_retry(self):
+        self.respond(502, 502, 502)
+        with self.assertRaises(GeocoderError):
+            self.create_geocoder().fetch_coordinates('Москва')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_error_is_not_retried(self):
+        self.respond(403)
+        with self.assertRaises(requests.HTTPError):
+            self.create_geocoder().fetch_coordinates('Москва')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_read_timeout_is_retried(self):
+        self.respond((200, build_geocoder_payload('1 2'), 0.5))
+        geocoder = self.create_geocoder(read_timeout=0.1)
+
+        self.assertEqual(geocoder.fetch_coordinates('Москва'), ('37.6', '55.7'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        geocoder = self.create_geocoder(max_retries=0, failure_threshold=2, recovery_timeout=30)
+        self.respond(500, 500)
+        for _ in range(2):
+            with self.assertRaises(GeocoderError):
+                geocoder.fetch_coordinates('Москва')
+
+        # Открыт: запросы не доходят до геокодера
+        with self.assertRaises(GeocoderUnavailable):
+            geocoder.fetch_coordinates('Москва')
+        self.assertEqual(len(self.server.requests), 2)
+
+        # Полуоткрыт: неудачный пробный запрос снова открывает выключатель
+        self.clock.monotonic.return_value += 31
+        self.respond(500)
+        with self.assertRaises(GeocoderError):
+            geocoder.fetch_coordinates('Москва')
+        with self.assertRaises(GeocoderUnavailable):
+            geocoder.fetch_coordinates('Москва')
+        self.assertEqual(len(self.server.requests), 3)
+
+        # Удачный пробный запрос закрывает выключатель
+        self.clock.monotonic.return_value += 31
+        self.assertEqual(geocoder.fetch_coordinates('Москва'), ('37.6', '55.7'))
+        self.assertEqual(geocoder.fetch_coordinates('Москва'), ('37.6', '55.7'))
+        self.assertEqual(len(self.server.requests), 5)
+
+
+class NormalizeAddressTest(SimpleTestCase):
+    def test_spellings_of_one_address_share_a_key(self):
+        spellings = [
+            'г. Москва, ул. Ленина, д. 5',
+            'Москва, улица Ленина, 5',
+            'москва   ул ленина дом 5',
+            'город Москва; ул. Ленина, д.5',
+            '«Москва», ул. Ленина, №5',
+        ]
+        self.assertEqual({normalize_address(address) for address in spellings}, {'москва улица ленина 5'})
+
+    def test_abbreviations_and_yo(self):
+        self.assertEqual(
+            normalize_address('Пр-т Мира, корп. 2, стр. 1'),
+            'проспект мира корпус 2 строение 1',
+        )
+        self.assertEqual(normalize_address('Щёлковское ш.'), normalize_address('щелковское шоссе'))
+
+    def test_different_addresses_stay_different(self):
+        self.assertNotEqual(normalize_address('ул. Ленина, 5'), normalize_address('ул. Ленина, 15'))
+        self.assertNotEqual(normalize_address('ул. Мира, 1'), normalize_address('пр-т Мира, 1'))
+
+    def test_key_fits_the_column(self):
+        self.assertEqual(len(normalize_address('улица ' * 100)), 255)
+
+
+@override_settings(
+    GEOCODE_ERROR_BACKOFF=60,
+    GEOCODE_NOT_FOUND_BACKOFF=3600,
+    GEOCODE_MAX_BACKOFF=4 * 3600,
+    GEOCODE_TTL=24 * 3600,
+)
+class PlaceBackoffTest(SimpleTestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def get_delays(self, place, status, attempts):
+        delays = []
+        for _ in range(attempts):
+            place.mark_failed(status, self.now)
+            delays.append((place.retry_after - self.now).total_seconds())
+        return delays
+
+    def test_geocoder_errors_back_off_exponentially_up_to_the_cap(self):
+        place = Place(address='Москва')
+        self.assertEqual(
+            self.get_delays(place, Place.ERROR, 10),
+            [60, 120, 240, 480, 960, 1920, 3840, 7680, 14400, 14400],
+        )
+        self.assertEqual(place.failed_attempts, 10)
+
+    def test_not_found_backs_off_longer(self):
+        place = Place(address='Нигде')
+        self.assertEqual(self.get_delays(place, Place.NOT_FOUND, 4), [3600, 7200, 14400, 14400])
+
+    def test_failed_refresh_keeps_coordinates_and_waits(self):
+        place = Place(address='Москва')
+        place.mark_found('37.6', '55.7', self.now - timedelta(days=2))
+        self.assertTrue(place.needs_geocoding(self.now))
+
+        place.mark_failed(Place.ERROR, self.now)
+        self.assertTrue(place.has_coordinates)
+        self.assertFalse(place.needs_geocoding(self.now))
+        self.assertTrue(place.needs_geocoding(self.now + timedelta(seconds=61)))
+
+    def test_success_resets_backoff(self):
+        place = Place(address='Москва')
+        self.get_delays(place, Place.ERROR, 3)
+        place.mark_found('37.6', '55.7', self.now)
+
+        self.assertEqual(place.failed_attempts, 0)
+        self.assertIsNone(place.retry_after)
+        self.assertFalse(place.needs_geocoding(self.now))
+        self.assertEqual(self.get_delays(place, Place.ERROR, 1), [60])
+
+
+class GeocodeInvalidationTest(TestCase):
+    def setUp(self):
+        self.place = Place.objects.create(
+            address='Москва, ул. Ленина, 5',
+            longitude='37.600000',
+            latitude='55.700000',
+            geocode_status=Place.OK,
+            create_date=timezone.now() - timedelta(days=365),
+        )
+        self.geocoder = mock.Mock()
+        for target, value in [
+            ('places.services.get_geocoder', mock.Mock(return_value=self.geocoder)),
+            ('places.services.geocode_cache', mock.Mock(get_many=mock.Mock(return_value={}))),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('places.services.invalidate_geocode_cache')
+        self.invalidate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def refresh(self):
+        place_map = geocode_addresses([self.place.address])
+        self.place.refresh_from_db()
+        return place_map
+
+    def test_failed_refresh_keeps_caches(self):
+        self.geocoder.fetch_coordinates.side_effect = GeocoderError('нет ответа')
+        self.assertIn(self.place.address_key, self.refresh())
+
+        self.assertEqual(self.place.geocode_status, Place.ERROR)
+        self.invalidate.assert_not_called()
+
+    def test_same_coordinates_keep_caches(self):
+        self.geocoder.fetch_coordinates.return_value = ('37.6', '55.7')
+        self.refresh()
+
+        self.assertEqual(self.place.geocode_status, Place.OK)
+        self.invalidate.assert_not_called()
+
+    def test_moved_place_invalidates_caches(self):
+        self.geocoder.fetch_coordinates.return_value = ('37.61', '55.7')
+        self.refresh()
+
+        self.assertEqual(str(self.place.longitude), '37.610000')
+        self.invalidate.assert_called_once_with()
+
+    def test_new_address_keeps_caches(self):
+        self.geocoder.fetch_coordinates.return_value = ('37.5', '55.6')
+        geocode_addresses(['Москва, ул. Мира, 1'])
+        self.invalidate.assert_not_called()
+
+    def test_every_request_waits_for_throttle(self):
+        self.geocoder.fetch_coordinates.return_value = ('37.5', '55.6')
+        throttle = mock.Mock()
+        geocode_addresses([f'Москва, ул. Мира, {number}' for number in range(1, 6)], throttle=throttle)
+
+        self.assertEqual(throttle.wait.call_count, 5)
+        self.assertEqual(self.geocoder.fetch_coordinates.call_count, 5)
+
+
+class RequestThrottleTest(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.sleeps = []
+        for target, side_effect in [
+            ('places.geocoder.time.monotonic', lambda: self.now),
+            ('places.geocoder.time.sleep', self.sleeps.append),
+        ]:
+            patcher = mock.patch(target, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_requests_are_spread_evenly(self):
+        throttle = RequestThrottle(rate=4)
+        for _ in range(4):
+            throttle.wait()
+        self.assertEqual(self.sleeps, [0.25, 0.5, 0.75])
+
+    def test_idle_time_does_not_allow_a_burst(self):
+        throttle = RequestThrottle(rate=4)
+        throttle.wait()
+        self.now += 10
+        throttle.wait()
+        throttle.wait()
+        self.assertEqual(self.sleeps, [0.25])
+
+
+class RecordingGeocoderTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.recording_path = os.path.join(self.directory, 'recording.json')
+
+    def test_workers_recording_one_file_keep_each_others_answers(self):
+        first_worker = RecordingGeocoder(self.recording_path, backend=mock.Mock(**{
+            'fetch_coordinates.return_value': ('37.6', '55.7'),
+        }))
+        second_worker = RecordingGeocoder(self.recording_path, backend=mock.Mock(**{
+            'fetch_coordinates.return_value': None,
+        }))
+        first_worker.fetch_coordinates('Москва, ул. Ленина, 5')
+        second_worker.fetch_coordinates('Нигде')
+
+        replay = RecordingGeocoder(self.recording_path)
+        self.assertEqual(replay.fetch_coordinates('москва улица ленина 5'), ('37.6', '55.7'))
+        self.assertIsNone(replay.fetch_coordinates('Нигде'))
+        with self.assertRaises(GeocoderError):
+            replay.fetch_coordinates('Москва, ул. Мира, 1')
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            ['recording.json', 'recording.json.lock'],
+        )
+
+    def test_replay_without_recording_is_misconfiguration(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RecordingGeocoder(self.recording_path)
+
+    def test_offline_without_gazetteer_is_misconfiguration(self):
+        with self.assertRaises(ImproperlyConfigured):
+            OfflineGeocoder(os.path.join(self.directory, 'gazetteer.json'))
@@ -1,18 +1,6 @@
-import requests
+from .geocoder import get_geocoder
 
-def fetch_coordinates(apikey, address):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(base_url, params={
-        "geocode": address,
-        "apikey": apikey,
-        "format": "json",
-    })
-    response.raise_for_status()
-    found_places = response.json()['response']['GeoObjectCollection']['featureMember']
-
-    if not found_places:
-        return None
 
-    most_relevant = found_places[0]
-    lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
-    return lon, lat
+def fetch_coordinates(apikey, address):
+    # Оставлено для совместимости: запросы идут через общий клиент геокодера
+    return get_geocoder().fetch_coordinates(address)
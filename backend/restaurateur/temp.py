@@ -1,7 +1,7 @@
+from places.addresses import normalize_address
 from places.models import Place  # Импортируем модель Place
-from places.views import fetch_coordinates  # Импортируем функцию fetch_coordinates
-from django.conf import settings
-from django.db.models import Sum, F, Count, Q
+from places.geocoder import get_geocoder  # Общий клиент геокодера
+from django.db.models import Count, Q
 from django.shortcuts import render
 from django.contrib.auth.decorators import user_passes_test
 from foodcartapp.models import Order, Restaurant
@@ -11,9 +11,7 @@ from geopy.distance import distance
 
 @user_passes_test(lambda user: user.is_staff, login_url='restaurateur:login')
 def view_orders(request):
-    orders = Order.objects.all().annotate(
-        total_price=Sum(F('items__price') * F('items__quantity'))
-    )
+    orders = Order.objects.all()
 
     available_restaurants_data = []
 
@@ -28,17 +26,17 @@ def view_orders(request):
     place_map = {}
 
     # Получаем все Place объекты для этих адресов одним запросом
-    places = Place.objects.filter(address__in=addresses)
-    place_map = {place.address: place for place in places}
+    places = Place.objects.filter(address_key__in={normalize_address(address) for address in addresses})
+    place_map = {place.address_key: place for place in places}
 
     restaurant_coordinates = {}
     for restaurant in restaurants:
-        place = place_map.get(restaurant.address)
+        place = place_map.get(normalize_address(restaurant.address))
         if place and place.latitude and place.longitude:
             restaurant_coordinates[restaurant.id] = (place.latitude, place.longitude)
         else:
             # Если координаты не найдены в Place, получаем их из API и сохраняем в Place
-            location = fetch_coordinates(settings.YANDEX_GEOCODER_API_KEY, restaurant.address)
+            location = get_geocoder().fetch_coordinates(restaurant.address)
             if location:
                 longitude, latitude = location
                 # Создаем Place, если его еще нет
@@ -48,7 +46,7 @@ def view_orders(request):
                     place.longitude = longitude
                     place.latitude = latitude
                     place.save()
-                place_map[restaurant.address] = place  # Обновляем кэш
+                place_map[place.address_key] = place  # Обновляем кэш
                 restaurant_coordinates[restaurant.id] = (latitude, longitude)
             else:
                 print(f"Не удалось получить координаты для ресторана {restaurant.name} из API")
@@ -72,12 +70,12 @@ def view_orders(request):
 
         try:
             # Ищем координаты заказчика в Place
-            place = place_map.get(order.address)
+            place = place_map.get(normalize_address(order.address))
             if place and place.latitude and place.longitude:
                 customer_coordinates = (place.latitude, place.longitude)
             else:
                 # Если координат нет в Place, получаем из API и сохраняем
-                location = fetch_coordinates(settings.YANDEX_GEOCODER_API_KEY, order.address)
+                location = get_geocoder().fetch_coordinates(order.address)
                 if location:
                     longitude, latitude = location
                     # Создаем Place, если его еще нет
@@ -87,7 +85,7 @@ def view_orders(request):
                         place.longitude = longitude
                         place.latitude = latitude
                         place.save()
-                    place_map[order.address] = place  # Обновляем кэш
+                    place_map[place.address_key] = place  # Обновляем кэш
                     customer_coordinates = (latitude, longitude)
                 else:
                     print(f"Не удалось получить координаты для адреса заказа {order.address} из API")
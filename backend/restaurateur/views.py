@@ -5,14 +5,15 @@ from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import user_passes_test
-from django.db.models import Sum, F, Q
+from django.db.models import Q
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.views import View
 
 from foodcartapp.models import Order, Product, Restaurant
-from foodcartapp.serializers import process_orders, process_restaurants
-from places.models import Place
+from foodcartapp.serializers import process_orders
+from foodcartapp.spatial import get_restaurant_index
+from places.services import geocode_addresses
 
 logger = logging.getLogger(__name__)
 
@@ -101,18 +102,14 @@ def view_orders(request):
 
     orders = Order.objects.filter(
         ~Q(status__in=['cls', 'cnc'])  # Исключаем закрытые и отмененные заказы
-    ).select_related('restaurant').prefetch_related('items').annotate(
-        total_price=Sum(F('items__price') * F('items__quantity'))
-    )
+    ).select_related('restaurant').prefetch_related('items')
 
-    restaurants = Restaurant.objects.all()
-    addresses = set(restaurant.address for restaurant in restaurants)
-    addresses.update(order.address for order in orders)
-    place_map = {place.address: place for place in Place.objects.filter(address__in=addresses)}
+    # Все недостающие адреса геокодируются одним пакетом до расчёта расстояний
+    place_map = geocode_addresses(order.address for order in orders)
     api_key = settings.YANDEX_GEOCODER_API_KEY
 
-    restaurant_coordinates = process_restaurants(restaurants, place_map, api_key)
-    available_restaurants_data = process_orders(orders, restaurant_coordinates, place_map, api_key)
+    restaurant_index = get_restaurant_index()
+    available_restaurants_data = process_orders(orders, restaurant_index, place_map, api_key)
 
     context = {
         'orders': orders.order_by('status'),
@@ -14,7 +14,36 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 SECRET_KEY = env('SECRET_KEY')
 DEBUG = env.bool('DEBUG', False)
-YANDEX_GEOCODER_API_KEY = env('YANDEX_GEOCODER_API_KEY')
+# Геокодер: yandex, offline (локальный справочник), record или replay (запись и повтор ответов)
+GEOCODER_BACKEND = env('GEOCODER_BACKEND', 'yandex')
+YANDEX_GEOCODER_API_KEY = env('YANDEX_GEOCODER_API_KEY', '')
+GEOCODER_GAZETTEER_PATH = env('GEOCODER_GAZETTEER_PATH', os.path.join(BASE_DIR, 'gazetteer.json'))
+GEOCODER_OFFLINE_SYNTHESIZE = env.bool('GEOCODER_OFFLINE_SYNTHESIZE', False)
+GEOCODER_RECORDING_PATH = env('GEOCODER_RECORDING_PATH', os.path.join(BASE_DIR, 'geocoder_recording.json'))
+# Искусственная задержка ответа offline и replay геокодеров, в секундах
+GEOCODER_LATENCY = env.float('GEOCODER_LATENCY', 0)
+GEOCODER_BACKGROUND_WORKERS = env.int('GEOCODER_BACKGROUND_WORKERS', 2)
+GEOCODER_BATCH_WORKERS = env.int('GEOCODER_BATCH_WORKERS', 8)
+GEOCODER_BASE_URL = env('GEOCODER_BASE_URL', 'https://geocode-maps.yandex.ru/1.x')
+GEOCODER_CONNECT_TIMEOUT = env.float('GEOCODER_CONNECT_TIMEOUT', 3)
+GEOCODER_READ_TIMEOUT = env.float('GEOCODER_READ_TIMEOUT', 5)
+GEOCODER_MAX_RETRIES = env.int('GEOCODER_MAX_RETRIES', 2)
+GEOCODER_FAILURE_THRESHOLD = env.int('GEOCODER_FAILURE_THRESHOLD', 5)
+GEOCODER_RECOVERY_TIMEOUT = env.int('GEOCODER_RECOVERY_TIMEOUT', 30)
+# Срок жизни найденных координат и задержки повторов неудачного геокодирования, в секундах
+GEOCODE_TTL = env.int('GEOCODE_TTL', 90 * 24 * 60 * 60)
+GEOCODE_ERROR_BACKOFF = env.int('GEOCODE_ERROR_BACKOFF', 60)
+GEOCODE_NOT_FOUND_BACKOFF = env.int('GEOCODE_NOT_FOUND_BACKOFF', 60 * 60)
+GEOCODE_MAX_BACKOFF = env.int('GEOCODE_MAX_BACKOFF', 7 * 24 * 60 * 60)
+GEOCODE_LOCAL_CACHE_SIZE = env.int('GEOCODE_LOCAL_CACHE_SIZE', 10000)
+GEOCODE_LOCAL_CACHE_TTL = env.int('GEOCODE_LOCAL_CACHE_TTL', 5 * 60)
+# Расстояния до ресторанов: haversine (векторно, numpy) или geodesic (точно, geopy)
+DISTANCE_METHOD = env('DISTANCE_METHOD', 'haversine')
+# Сколько ближайших ресторанов и в каком радиусе (км) предлагать заказу; пусто — без ограничений
+NEAREST_RESTAURANTS_LIMIT = env.int('NEAREST_RESTAURANTS_LIMIT', None)
+DELIVERY_RADIUS_KM = env.float('DELIVERY_RADIUS_KM', None)
+RESTAURANT_INDEX_CELL_KM = env.float('RESTAURANT_INDEX_CELL_KM', 2)
+RESTAURANT_INDEX_TTL = env.int('RESTAURANT_INDEX_TTL', 5 * 60)
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', ['127.0.0.1', 'localhost'])
 ROLLBAR_ACCESS_TOKEN = env('ROLLBAR_ACCESS_TOKEN', default='')
 ROLLBAR_ENVIRONMENT = env('ROLLBAR_ENVIRONMENT', default='production')
@@ -29,6 +58,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'debug_toolbar',
     'rest_framework',
     'places',
@@ -36,6 +66,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodcartapp.ratelimit.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -104,6 +135,65 @@ DATABASES['default']['OPTIONS'] = {
     'options': '-c search_path=starburger_db_schema'
 }
 
+# Файловый кэш общий для всех воркеров gunicorn внутри контейнера
+CACHE_LOCATION = env('CACHE_LOCATION', '/tmp/star_burger_cache')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_LOCATION,
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('CACHE_MAX_ENTRIES', 1000),
+        },
+    },
+    # Версии, поколения и снимок каталога: ключей немного, и вытеснять
+    # их вместе с меню ресторанов нельзя
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': f'{CACHE_LOCATION}_versions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+VERSION_CACHE = 'versions'
+
+# Потоковая отдача каталога без снимка в кэше — для очень больших каталогов
+CATALOG_STREAMING = env.bool('CATALOG_STREAMING', False)
+CATALOG_CHUNK_SIZE = env.int('CATALOG_CHUNK_SIZE', 500)
+CATALOG_PAGE_SIZE = env.int('CATALOG_PAGE_SIZE', 100)
+CATALOG_MAX_PAGE_SIZE = env.int('CATALOG_MAX_PAGE_SIZE', 500)
+RESTAURANT_MENU_CACHE_TIMEOUT = env.int('RESTAURANT_MENU_CACHE_TIMEOUT', 60 * 60)
+BANNERS_CACHE_TIMEOUT = env.int('BANNERS_CACHE_TIMEOUT', 5 * 60)
+# Клиенты с более старой версией каталога получают 410 и загружают каталог целиком
+CATALOG_CHANGES_RETENTION_DAYS = env.int('CATALOG_CHANGES_RETENTION_DAYS', 7)
+
+# Заказы складываются в очередь и создаются командой process_order_ingestions
+ORDER_INGESTION_ASYNC = env.bool('ORDER_INGESTION_ASYNC', False)
+ORDER_BATCH_MAX_SIZE = env.int('ORDER_BATCH_MAX_SIZE', 5000)
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+# Ограничение частоты запросов к API: (запросов в секунду, запросов за окно)
+RATE_LIMIT_ENABLED = env.bool('RATE_LIMIT_ENABLED', True)
+RATE_LIMITS = {
+    'checkout': (
+        env.float('RATE_LIMIT_CHECKOUT_RATE', 1),
+        env.float('RATE_LIMIT_CHECKOUT_BURST', 10),
+    ),
+    'catalog': (
+        env.float('RATE_LIMIT_CATALOG_RATE', 5),
+        env.float('RATE_LIMIT_CATALOG_BURST', 30),
+    ),
+    'status': (
+        env.float('RATE_LIMIT_STATUS_RATE', 2),
+        env.float('RATE_LIMIT_STATUS_BURST', 20),
+    ),
+}
+RATE_LIMIT_TOTAL = (
+    env.float('RATE_LIMIT_TOTAL_RATE', 100),
+    env.float('RATE_LIMIT_TOTAL_BURST', 200),
+)
+RATE_LIMIT_CHECKOUT_RESERVE = env.float('RATE_LIMIT_CHECKOUT_RESERVE', 0.2)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -30,9 +30,15 @@ sleep 10
 echo "Применение миграций..."
 docker-compose exec -T backend python manage.py migrate --noinput
 
+echo "Подготовка уменьшенных копий картинок..."
+docker-compose exec -T backend python manage.py generate_renditions
+
 echo "Сборка статических файлов..."
 docker-compose exec -T backend python manage.py collectstatic --noinput
 
+echo "Прогрев координат ресторанов и открытых заказов..."
+docker-compose exec -T backend python manage.py geocode_warm || echo "Прогрев координат не завершён, адреса догеокодируются при работе"
+
 # Проверяем статус контейнеров
 echo "Проверка статуса контейнеров..."
 docker-compose ps
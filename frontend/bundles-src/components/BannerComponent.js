@@ -13,7 +13,10 @@ const BannerComponent = (props) => {
   let carousel_items = props.banners.map( (cfg, index) => {
     return (
       <div className={index ? 'item' : 'item active'} key={index}>
-        <img src={cfg.src} alt={cfg.title} style={bannerStyle}/>
+        <picture>
+          {cfg.srcset && cfg.srcset.webp && <source type="image/webp" srcSet={cfg.srcset.webp} sizes="100vw"/>}
+          <img src={cfg.src} srcSet={(cfg.srcset && cfg.srcset.default) || undefined} sizes="100vw" alt={cfg.title} style={bannerStyle}/>
+        </picture>
         <div className="carousel-caption">
           <h3>{cfg.title}</h3>
           <p>{cfg.text}</p>